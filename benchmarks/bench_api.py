@@ -0,0 +1,341 @@
+"""Latency and throughput benchmark of the FastAPI service
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+import httpx
+import numpy as np
+import pandas as pd
+
+
+def load_records(data_pth, n_records, n_warmup_records=0, seed=42):
+    """Sample User payloads from the clean dataset
+
+    Warm-up payloads are drawn from other distinct rows than the measured
+    ones, so that warm-up does not fill the prediction cache with the very
+    records that are then measured.
+
+    Parameters
+    ----------
+    data_pth: string
+        Path of the clean dataset.
+    n_records: int
+        Number of payloads to sample for the measured requests.
+    n_warmup_records: int, default=0
+        Number of payloads to sample for the warm-up requests.
+    seed: int, default=42
+        Random seed of the sample.
+
+    Returns
+    -------
+    records: list of dictionary
+        JSON payloads of the User object.
+    warmup_records: list of dictionary
+        JSON payloads for warm-up, none of them among records.
+    """
+    df = pd.read_csv(data_pth, skipinitialspace=True)
+    df = df.drop(columns=["salary"]).drop_duplicates().sample(
+        frac=1.0, random_state=seed)
+    df.columns = [c.replace("-", "_") for c in df.columns]
+    if n_warmup_records >= len(df):
+        raise ValueError("Not enough distinct records left to measure")
+
+    df_warmup = df.iloc[:n_warmup_records]
+    df = df.iloc[n_warmup_records:]
+    df = df.sample(n=n_records, replace=n_records > len(df),
+                   random_state=seed)
+
+    return (json.loads(df.to_json(orient="records")),
+            json.loads(df_warmup.to_json(orient="records")))
+
+
+def parse_mix(mix):
+    """Parse a payload mix such as "single:0.9,batch:0.1"
+
+    Returns
+    -------
+    weights: dictionary
+        Relative weight of every route.
+    """
+    weights = {}
+    for part in mix.split(","):
+        route, weight = part.split(":")
+        if route not in ("single", "batch"):
+            raise ValueError(f"Unknown route {route!r} in mix")
+        weights[route] = float(weight)
+
+    return weights
+
+
+def _build_requests(records, weights, n_requests, batch_size, seed=42):
+    """Draw the sequence of (route, method path, payload) to send
+    """
+    rng = random.Random(seed)
+    routes = rng.choices(
+        list(weights), weights=list(weights.values()), k=n_requests)
+
+    requests = []
+    for i, route in enumerate(routes):
+        if route == "single":
+            requests.append((route, "/", records[i % len(records)]))
+        else:
+            batch = [records[(i * batch_size + j) % len(records)]
+                     for j in range(batch_size)]
+            requests.append((route, "/batch", batch))
+
+    return requests
+
+
+async def _drive(client, requests, concurrency):
+    """Send requests with at most `concurrency` of them in flight
+
+    Returns
+    -------
+    samples: list of tuple
+        (route, latency in seconds, status code) of every request.
+    elapsed: float
+        Wall time of the whole run in seconds.
+    """
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+    samples = []
+
+    async def worker():
+        while not queue.empty():
+            route, path, payload = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                r = await client.post(path, json=payload)
+                status = r.status_code
+            except httpx.HTTPError:
+                status = 0
+            samples.append((route, time.perf_counter() - start, status))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed, batch_size):
+    """Aggregate latency percentiles and throughput per route
+
+    Returns
+    -------
+    summary: dictionary
+        Statistics keyed by route.
+    """
+    summary = {}
+    for route in sorted({s[0] for s in samples}):
+        latencies = np.array([s[1] for s in samples if s[0] == route])
+        errors = sum(1 for s in samples if s[0] == route and s[2] != 200)
+        rows = len(latencies) * (batch_size if route == "batch" else 1)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        summary[route] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "rows_per_second": round(rows / elapsed, 1),
+        }
+
+    return summary
+
+
+async def run_in_process(requests, concurrency, warmup_requests):
+    """Benchmark the app in-process through an ASGI transport
+
+    The app, and so its prediction cache, is shared by every in-process
+    run, so the cache is cleared before each measured run.
+    """
+    import src.api as api
+
+    await api.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench") as client:
+            await _drive(client, warmup_requests, concurrency)
+            api.cache.clear()
+            return await _drive(client, requests, concurrency)
+    finally:
+        await api.app.router.shutdown()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_uvicorn(requests, concurrency, warmup_requests,
+                      startup_timeout=60):
+    """Benchmark the app served by a local uvicorn process
+    """
+    port = _free_port()
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "src.api:app",
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"])
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(
+                base_url=base_url, limits=limits, timeout=60) as client:
+            deadline = time.monotonic() + startup_timeout
+            while True:
+                try:
+                    if (await client.get("/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError("uvicorn server did not start")
+                await asyncio.sleep(0.1)
+
+            await _drive(client, warmup_requests, concurrency)
+            return await _drive(client, requests, concurrency)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(results, baseline):
+    """Print the relative change of every statistic against a baseline run
+    """
+    baseline_runs = {(r["mode"], r["concurrency"]): r
+                     for r in baseline["runs"]}
+    for run in results["runs"]:
+        previous = baseline_runs.get((run["mode"], run["concurrency"]))
+        if previous is None:
+            continue
+        for route, stats in run["routes"].items():
+            old = previous["routes"].get(route)
+            if old is None:
+                continue
+            changes = ", ".join(
+                f"{k} {(stats[k] - old[k]) / old[k] * 100:+.1f}%"
+                for k in ["p50_ms", "p99_ms", "requests_per_second"]
+                if old[k])
+            print(f"[{run['mode']} c={run['concurrency']} {route}] "
+                  f"{changes}")
+
+
+def execute(args):
+    """Execute the benchmark and write its results
+
+    Drives `src.api:app` either in-process through an ASGI transport, which
+    measures the application alone, or over HTTP against a local uvicorn
+    server, which adds the server and network stack. Requests are sent by a
+    pool of concurrent clients following a weighted mix of the single record
+    and batch routes.
+    """
+    records, warmup_records = load_records(
+        args.data, args.records, n_warmup_records=args.warmup)
+    weights = parse_mix(args.mix)
+    requests = _build_requests(records, weights, args.requests,
+                               args.batch_size)
+    warmup_requests = _build_requests(warmup_records, weights, args.warmup,
+                                      args.batch_size) if args.warmup else []
+    modes = ["inprocess", "uvicorn"] if args.mode == "both" else [args.mode]
+
+    runs = []
+    for mode in modes:
+        for concurrency in args.concurrency:
+            runner = run_in_process if mode == "inprocess" else run_uvicorn
+            samples, elapsed = asyncio.run(
+                runner(requests, concurrency, warmup_requests))
+            routes = summarize(samples, elapsed, args.batch_size)
+            runs.append({"mode": mode, "concurrency": concurrency,
+                         "elapsed_s": round(elapsed, 3), "routes": routes})
+            for route, stats in routes.items():
+                print(f"[{mode} c={concurrency} {route}] {stats}")
+
+    results = {
+        "config": {
+            "requests": args.requests,
+            "mix": args.mix,
+            "batch_size": args.batch_size,
+            "warmup": args.warmup,
+        },
+        "runs": runs,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="API benchmark")
+
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=["inprocess", "uvicorn", "both"],
+        default="inprocess",
+        help="Drive the app in-process or over a local uvicorn server")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 16],
+        help="Number of concurrent clients, one run per value")
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=1000,
+        help="Number of measured requests per run")
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=50,
+        help="Number of unmeasured requests sent before every run, built "
+             "from as many records kept out of the measured ones")
+    parser.add_argument(
+        "--mix",
+        type=str,
+        default="single:0.9,batch:0.1",
+        help="Relative weights of the single record and batch routes")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Number of records per batch request")
+    parser.add_argument(
+        "--records",
+        type=int,
+        default=5000,
+        help="Number of distinct records sampled from the dataset")
+    parser.add_argument(
+        "--data",
+        type=str,
+        default="./data/clean_data/clean_census.csv",
+        help="Dataset the records are sampled from")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="bench_results.json",
+        help="Path of the JSON results")
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="JSON results of a previous run to compare against")
+
+    args = parser.parse_args()
+
+    execute(args)
@@ -0,0 +1,169 @@
+"""Startup time and memory benchmark of the model artifact formats
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def _memory():
+    """Read the memory of this process from /proc, in MiB
+
+    Rss counts every resident page, Pss splits shared pages between the
+    processes mapping them, and Uss only counts private pages.
+    """
+    stats = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                stats[parts[0].rstrip(":")] = int(parts[1]) / 1024
+
+    return {
+        "rss_mb": round(stats["Rss"], 1),
+        "pss_mb": round(stats["Pss"], 1),
+        "uss_mb": round(stats["Private_Clean"] + stats["Private_Dirty"], 1),
+    }
+
+
+def worker(model_dir, compact_pth):
+    """Load the artifacts like an API worker and report its cost
+
+    Prints the load timings once ready, then waits for a line on stdin
+    before reading its memory, so that all workers of a run are alive and
+    share what they can when measured.
+    """
+    start = time.perf_counter()
+    from src.model_registry import ModelRegistry
+    imported = time.perf_counter()
+
+    registry = ModelRegistry(
+        model_pth=os.path.join(model_dir, "model.joblib"),
+        cat_encoder_pth=os.path.join(model_dir, "ohe.joblib"),
+        label_binarizer_pth=os.path.join(model_dir, "lb.joblib"),
+        compact_pth=compact_pth)
+    artifacts = registry.load()
+    loaded = time.perf_counter()
+
+    X = np.zeros((1, artifacts.encoder.n_features))
+    artifacts.forest.predict(X)
+    predicted = time.perf_counter()
+
+    print(json.dumps({
+        "import_s": round(imported - start, 4),
+        "load_s": round(loaded - imported, 4),
+        "first_predict_s": round(predicted - loaded, 4),
+        "format": "joblib" if artifacts.model is not None else "compact",
+    }), flush=True)
+    sys.stdin.readline()
+    print(json.dumps(_memory()), flush=True)
+
+
+def run(model_dir, compact_pth, n_workers):
+    """Start n_workers worker processes and gather their reports
+    """
+    cmd = [sys.executable, "-m", "benchmarks.bench_artifacts",
+           "--model-dir", model_dir, "--worker"]
+    if compact_pth is not None:
+        cmd += ["--compact", compact_pth]
+    workers = [subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, text=True)
+               for _ in range(n_workers)]
+
+    reports = [json.loads(w.stdout.readline()) for w in workers]
+    for w in workers:
+        w.stdin.write("\n")
+        w.stdin.flush()
+    for w, report in zip(workers, reports):
+        report.update(json.loads(w.stdout.readline()))
+        w.wait()
+
+    return reports
+
+
+def summarize(reports):
+    """Median of every statistic over the workers of a run
+    """
+    keys = [k for k in reports[0] if k != "format"]
+    summary = {k: float(np.median([r[k] for r in reports])) for k in keys}
+    summary["format"] = reports[0]["format"]
+
+    return summary
+
+
+def execute(args):
+    """Execute the benchmark and write its results
+
+    Starts the same number of worker processes loading the joblib artifacts
+    and then the compact export, and reports the median import, load and
+    first prediction times and memory per worker. The compact export is
+    written to a temporary directory if there is none in the model directory.
+    """
+    from src.model_export import export_compact
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        compact_pth = os.path.join(args.model_dir, "compact")
+        if not os.path.exists(os.path.join(compact_pth, "vocab.json")):
+            compact_pth = os.path.join(tmp_dir, "compact")
+            export_compact(
+                os.path.join(args.model_dir, "model.joblib"),
+                os.path.join(args.model_dir, "ohe.joblib"),
+                os.path.join(args.model_dir, "lb.joblib"),
+                compact_pth)
+
+        results = {"workers": args.workers, "runs": {}}
+        for name, pth in [("joblib", None), ("compact", compact_pth)]:
+            summary = summarize(run(args.model_dir, pth, args.workers))
+            if summary["format"] != name:
+                raise RuntimeError(f"Workers loaded {summary['format']} "
+                                   f"artifacts instead of {name}")
+            results["runs"][name] = summary
+            print(f"[{name}] {summary}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Model artifacts benchmark")
+
+    parser.add_argument(
+        "--model-dir",
+        type=str,
+        default="./model",
+        help="Directory of the joblib artifacts")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of worker processes alive at the same time")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="bench_artifacts.json",
+        help="Path of the JSON results")
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--compact",
+        type=str,
+        default=None,
+        help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.model_dir, args.compact)
+    else:
+        execute(args)
@@ -0,0 +1,83 @@
+"""Benchmark the flat forest evaluator against RandomForest.predict
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import argparse
+import time
+import joblib
+import numpy as np
+import pandas as pd
+import src.utils as u
+
+from src.flat_forest import FlatForest
+
+
+def _time_per_call(fn, X, repeats):
+    """Get the best wall time of fn(X) over several repeats
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(X)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def run_benchmark(batch_sizes, repeats):
+    """Compare prediction latency of both evaluators over batch sizes
+
+    Parameters
+    ----------
+    batch_sizes: list of int
+        Number of rows predicted per call.
+    repeats: int
+        Number of calls per batch size, the best one is reported.
+    """
+    model = joblib.load("./model/model.joblib")
+    cat_encoder = joblib.load("./model/ohe.joblib")
+    label_binarizer = joblib.load("./model/lb.joblib")
+    df = pd.read_csv("./data/clean_data/clean_census.csv",
+                     skipinitialspace=True)
+
+    X, _, _, _ = u.process_data(
+        df=df,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=cat_encoder,
+        label_binarizer=label_binarizer)
+
+    forest = FlatForest.from_sklearn(model)
+    mismatches = int(np.sum(forest.predict(X) != model.predict(X)))
+    print(f"Mismatched predictions over {len(X)} rows: {mismatches}")
+
+    print(f"{'batch':>8} {'sklearn ms':>12} {'flat ms':>10} {'speedup':>8}")
+    for batch_size in batch_sizes:
+        X_batch = X[:batch_size]
+        t_sklearn = _time_per_call(model.predict, X_batch, repeats)
+        t_flat = _time_per_call(forest.predict, X_batch, repeats)
+        print(f"{batch_size:>8} {t_sklearn * 1000:>12.3f} "
+              f"{t_flat * 1000:>10.3f} {t_sklearn / t_flat:>7.1f}x")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Flat forest benchmark")
+
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 16, 64, 256, 1024, 8192],
+        help="Number of rows predicted per call")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=20,
+        help="Number of calls per batch size")
+
+    args = parser.parse_args()
+
+    run_benchmark(args.batch_sizes, args.repeats)
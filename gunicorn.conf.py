@@ -0,0 +1,74 @@
+"""Gunicorn configuration of the production server
+
+The app is imported and its model artifacts are loaded once in the master
+process, then the workers are forked from it and share those pages copy on
+write instead of each loading their own copy. The master also watches the
+artifacts: when they change, it loads the new ones and gracefully replaces
+every worker with one forked from the updated master.
+
+Run with `gunicorn src.api:app -c gunicorn.conf.py`.
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import gc
+import os
+import signal
+import threading
+import time
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Predictions are CPU bound, so one worker per core. Heroku sets
+# WEB_CONCURRENCY from the dyno size.
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+# Old workers get this long to finish their requests on a restart:
+graceful_timeout = 30
+timeout = 60
+
+# Seconds between two checks of the artifacts by the master, 0 disables it.
+reload_interval = float(os.environ.get("MODEL_RELOAD_INTERVAL", "30"))
+
+raw_env = [
+    # The master reloads the artifacts, not every worker on its own:
+    "MODEL_RELOAD_INTERVAL=0",
+    # The workers already use every core, a single prediction thread each
+    # avoids oversubscribing them:
+    f"PREDICT_POOL_SIZE={os.environ.get('PREDICT_POOL_SIZE', '1')}",
+]
+
+
+def on_starting(server):
+    """Fetch and load the artifacts in the master, before any fork
+    """
+    import src.api as api
+    from src.artifacts import pull_artifacts
+
+    pull_artifacts()
+    api.registry.load()
+    # Keep the garbage collector from touching, and so copying, the objects
+    # shared with the workers:
+    gc.freeze()
+
+
+def _watch_artifacts(server):
+    import src.api as api
+
+    while True:
+        time.sleep(reload_interval)
+        if api.registry.reload_if_changed():
+            gc.freeze()
+            server.log.info("Model artifacts changed, restarting workers")
+            os.kill(server.pid, signal.SIGHUP)
+
+
+def when_ready(server):
+    """Start watching the artifacts once the master is up
+    """
+    if reload_interval > 0:
+        threading.Thread(
+            target=_watch_artifacts, args=(server,), daemon=True).start()
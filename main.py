@@ -5,9 +5,35 @@ Date: 2022-01-07
 """
 import argparse
 import logging
+import sklearn
+import src.utils as u
 import src.basic_cleaning as bc
 import src.model_training as mt
 import src.model_inference as mi
+import src.model_export as me
+import src.model_precompute as mp
+import src.model_scoring as ms
+import src.model_tuning as mtu
+
+from src.stage_cache import StageCache
+
+
+# Record of the last run of every stage:
+STAGE_CACHE_PATH = "./.stage_cache.json"
+
+# Files read and written by the stages:
+RAW_DATA_PATH = "./data/raw_data/raw_census.csv"
+# Stages reading the clean data may load its columnar cache instead, which
+# is only used while it matches the hash of this CSV, so the CSV alone is
+# the stage input:
+CLEAN_DATA_PATH = "./data/clean_data/clean_census.csv"
+MODEL_PATHS = ["./model/model.joblib", "./model/ohe.joblib",
+               "./model/lb.joblib"]
+SLICE_METRICS_PATHS = ["./model/slice_metrics.txt",
+                       "./model/slice_metrics.json"]
+
+# Source files every stage depends on, besides its own module:
+COMMON_CODE = ["./src/utils.py", "./src/schema.py", "./src/data_cache.py"]
 
 
 def execute_pipeline(args):
@@ -15,17 +41,71 @@ def execute_pipeline(args):
     """
     logging.basicConfig(level=logging.INFO)
 
+    # Stages whose inputs, code and parameters did not change since their
+    # last run are skipped, unless forced:
+    stages = StageCache(STAGE_CACHE_PATH)
+
     if (args.action == "combo" or args.action == "basic_cleaning"):
         logging.info("Start basic data cleaning ...")
-        bc.execute()
+        stages.run(
+            "basic_cleaning",
+            lambda: bc.execute(
+                chunksize=args.chunksize if args.chunked else None,
+                n_jobs=None if args.n_jobs == -1 else args.n_jobs),
+            inputs=[RAW_DATA_PATH],
+            outputs=[CLEAN_DATA_PATH],
+            code=["./src/basic_cleaning.py"] + COMMON_CODE,
+            force=args.force)
+
+    if (args.action == "tune"):
+        logging.info("Hyperparameter tuning procedure start ...")
+        mtu.execute(
+            n_candidates=args.n_candidates,
+            n_jobs=-1 if args.n_jobs is None else args.n_jobs)
 
     if (args.action == "combo" or args.action == "training"):
         logging.info("Model training procedure start ...")
-        mt.execute()
+        # The number of workers does not change the trained model:
+        params = u._get_model_params()
+        params.pop("n_jobs")
+        params["sklearn"] = sklearn.__version__
+        chunksize = args.chunksize if args.out_of_core else None
+        if chunksize is not None:
+            params["out_of_core_chunksize"] = chunksize
+        stages.run(
+            "training",
+            lambda: mt.execute(n_jobs=args.n_jobs, chunksize=chunksize),
+            inputs=[CLEAN_DATA_PATH],
+            outputs=MODEL_PATHS,
+            code=["./src/model_training.py"] + COMMON_CODE,
+            params=params,
+            force=args.force)
 
     if (args.action == "combo" or args.action == "inference"):
         logging.info("Model inference procedure start ...")
-        mi.execute()
+        stages.run(
+            "inference",
+            mi.execute,
+            inputs=[CLEAN_DATA_PATH] + MODEL_PATHS,
+            outputs=SLICE_METRICS_PATHS,
+            code=["./src/model_inference.py"] + COMMON_CODE,
+            params={"sklearn": sklearn.__version__},
+            force=args.force)
+
+    if (args.action == "export"):
+        logging.info("Model export procedure start ...")
+        me.execute()
+
+    if (args.action == "precompute"):
+        logging.info("Lookup table precompute procedure start ...")
+        mp.execute(input_pth=args.input, max_entries=args.max_entries)
+
+    if (args.action == "score"):
+        logging.info("Batch scoring procedure start ...")
+        ms.execute(
+            input_pth=args.input,
+            output_pth=args.output,
+            chunksize=args.chunksize)
 
 
 if __name__ == "__main__":
@@ -35,10 +115,70 @@ if __name__ == "__main__":
     parser.add_argument(
         "--action",
         type=str,
-        choices=["basic_cleaning", "train_test_model", "inference", "combo"],
+        choices=["basic_cleaning", "training", "inference", "combo",
+                 "export", "precompute", "score", "tune"],
         default="combo",
         help="Pipeline action")
 
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=None,
+        help="Number of training or chunked cleaning workers, -1 uses all "
+             "cores")
+
+    parser.add_argument(
+        "--n-candidates",
+        type=int,
+        default=64,
+        help="Number of parameter combinations sampled by the tune action")
+
+    parser.add_argument(
+        "--input",
+        type=str,
+        default="./data/clean_data/clean_census.csv",
+        help="CSV file to score with the score action, or to tabulate with "
+             "the precompute action")
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./data/predictions.csv",
+        help="CSV file the score action writes predictions to")
+
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=50000,
+        help="Number of rows processed at once by the score action, "
+             "chunked basic cleaning and out of core training")
+
+    parser.add_argument(
+        "--chunked",
+        action="store_true",
+        help="Stream basic cleaning in chunks of --chunksize rows across "
+             "a process pool, for raw data larger than memory")
+
+    parser.add_argument(
+        "--out-of-core",
+        action="store_true",
+        help="Train on chunks of --chunksize rows streamed from the clean "
+             "data, growing the forest chunk by chunk, for data larger "
+             "than memory")
+
+    parser.add_argument(
+        "--max-entries",
+        type=int,
+        default=None,
+        help="Number of most frequent distinct records kept by the "
+             "precompute action, all of them by default")
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run the cleaning, training and inference stages even if "
+             "their inputs, code and parameters did not change")
+
     args = parser.parse_args()
 
     execute_pipeline(args)
@@ -4,118 +4,597 @@ Author: Dan Sun
 Date: 2022-01-07
 """
 import os
-import joblib
-import numpy as np
+import json
+import time
+import asyncio
+import logging
 import pandas as pd
+import src.schema as sc
 import src.utils as u
 
-# Literal types let you indicate that an expression is equal to some specific
-# primitive value. For example, if we annotate a variable with type
-# Literal["foo"], this .py script will understand that variable is not only of
-# type str, but is also equal to specifically the string "foo".
-from typing import Literal
-from fastapi import FastAPI
-from pydantic import BaseModel
+from typing import List, Union
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, ValidationError, root_validator
+from starlette.requests import ClientDisconnect
+from src.artifacts import pull_artifacts
+from src.metrics import MetricsMiddleware, MetricsRegistry
+from src.micro_batching import MicroBatcher
+from src.model_registry import ModelRegistry
+from src.prediction_cache import PredictionCache
+from src.prediction_executor import BoundedExecutor, QueueFullError
+from src.schema import (Education, MaritalStatus, NativeCountry, Occupation,
+                        Race, Relationship, Sex, Workclass)
+from src.streaming import (DuplexStreamingResponse, LineTooLongError,
+                           iter_lines)
 
 
 # Declare the data object with its components and their type.
 class User(BaseModel):
-    workclass: Literal[
-        'State-gov', 'Self-emp-not-inc', 'Private', 'Federal-gov',
-        'Local-gov', 'Self-emp-inc', 'Without-pay']
-    education: Literal[
-        'Bachelors', 'HS-grad', '11th', 'Masters', '9th', 'Some-college',
-        'Assoc-acdm', '7th-8th', 'Doctorate', 'Assoc-voc', 'Prof-school',
-        '5th-6th', '10th', 'Preschool', '12th', '1st-4th']
-    marital_status: Literal[
-        'Never-married', 'Married-civ-spouse', 'Divorced',
-        'Married-spouse-absent', 'Separated', 'Married-AF-spouse', 'Widowed']
-    occupation: Literal[
-        'Adm-clerical', 'Exec-managerial', 'Handlers-cleaners',
-        'Prof-specialty', 'Other-service', 'Sales', 'Transport-moving',
-        'Farming-fishing', 'Machine-op-inspct', 'Tech-support',
-        'Craft-repair', 'Protective-serv', 'Armed-Forces', 'Priv-house-serv']
-    relationship: Literal[
-        'Not-in-family', 'Husband', 'Wife', 'Own-child', 'Unmarried',
-        'Other-relative']
-    race: Literal[
-        'White', 'Black', 'Asian-Pac-Islander', 'Amer-Indian-Eskimo', 'Other']
-    sex: Literal['Male', 'Female']
-    native_country: Literal[
-        'United-States', 'Cuba', 'Jamaica', 'India', 'Mexico', 'Puerto-Rico',
-        'Honduras', 'England', 'Canada', 'Germany', 'Iran', 'Philippines',
-        'Poland', 'Columbia', 'Cambodia', 'Thailand', 'Ecuador', 'Laos',
-        'Taiwan', 'Haiti', 'Portugal', 'Dominican-Republic', 'El-Salvador',
-        'France', 'Guatemala', 'Italy', 'China', 'South', 'Japan',
-        'Yugoslavia', 'Peru', 'Outlying-US(Guam-USVI-etc)', 'Scotland',
-        'Trinadad&Tobago', 'Greece', 'Nicaragua', 'Vietnam', 'Hong', 'Ireland',
-        'Hungary', 'Holand-Netherlands']
+    workclass: Workclass
+    education: Education
+    marital_status: MaritalStatus
+    occupation: Occupation
+    relationship: Relationship
+    race: Race
+    sex: Sex
+    native_country: NativeCountry
     age: int
     education_num: int
     hours_per_week: int
 
 
-if "DYNO" in os.environ and os.path.isdir(".dvc"):
-    os.system("dvc config core.no_scm true")
-    if os.system("dvc pull") != 0:
-        exit("dvc pull failed")
-    os.system("rm -r .dvc .apt/usr/lib/dvc")
+# Declare the columnar batch data object: one array per User field.
+class UserColumns(BaseModel):
+    workclass: List[Workclass]
+    education: List[Education]
+    marital_status: List[MaritalStatus]
+    occupation: List[Occupation]
+    relationship: List[Relationship]
+    race: List[Race]
+    sex: List[Sex]
+    native_country: List[NativeCountry]
+    age: List[int]
+    education_num: List[int]
+    hours_per_week: List[int]
+
+    @root_validator(skip_on_failure=True)
+    def check_same_length(cls, values):
+        if len({len(v) for v in values.values()}) > 1:
+            raise ValueError("All columns must have the same length")
+        return values
+
+    def __len__(self):
+        return len(self.age)
+
+
+# Artifacts are loaded once at startup and shared by all requests. Every
+# MODEL_RELOAD_INTERVAL seconds the files are checked for changes and hot
+# reloaded, so new artifacts do not require a worker restart. Set the
+# interval to 0 to disable reloading. An up to date compact export in
+# MODEL_DIR/compact, written by `python main.py --action export`, is loaded
+# instead of the joblib files: its arrays are memory mapped, so the worker
+# processes share their pages instead of each unpickling the forest.
+# Likewise an up to date table in MODEL_DIR/lookup, written by
+# `python main.py --action precompute`, answers single record requests for
+# the records it holds without running the forest at all.
+MODEL_DIR = os.environ.get("MODEL_DIR", "./model")
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", "30"))
+
+# Artifacts are fetched and loaded in the background once the server is up,
+# so it binds its port right away. Prediction requests arriving before they
+# are ready wait for at most ARTIFACTS_WAIT_TIMEOUT seconds, then get a 503.
+ARTIFACTS_WAIT_TIMEOUT = float(os.environ.get("ARTIFACTS_WAIT_TIMEOUT", "30"))
+
+# Newly loaded artifacts predict a synthetic batch of WARM_UP_SIZE records
+# through every prediction path before GET /health/ready reports them ready.
+WARM_UP_SIZE = int(os.environ.get("WARM_UP_SIZE", "16"))
+
+# Predict with the forest flattened into numpy arrays, which returns the same
+# classes as the sklearn model at a fraction of its per call overhead. Past
+# FLAT_FOREST_MAX_ROWS rows the multi-threaded sklearn traversal wins again.
+USE_FLAT_FOREST = os.environ.get("USE_FLAT_FOREST", "1") == "1"
+FLAT_FOREST_MAX_ROWS = int(os.environ.get("FLAT_FOREST_MAX_ROWS", "512"))
+
+# Largest number of records accepted by a single batch prediction request.
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "10000"))
+
+# POST /stream reads newline delimited records as they arrive and predicts
+# them STREAM_CHUNK_SIZE at a time, so only one chunk is held in memory.
+# Lines longer than STREAM_MAX_LINE_BYTES end the stream with an error.
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", "1000"))
+STREAM_MAX_LINE_BYTES = int(os.environ.get("STREAM_MAX_LINE_BYTES", "65536"))
+
+# Concurrent single record requests are coalesced for at most
+# MICRO_BATCH_MAX_WAIT_MS milliseconds, or until MICRO_BATCH_MAX_SIZE records
+# are gathered, and then predicted as one matrix.
+MICRO_BATCH_MAX_SIZE = int(os.environ.get("MICRO_BATCH_MAX_SIZE", "64"))
+MICRO_BATCH_MAX_WAIT_MS = float(
+    os.environ.get("MICRO_BATCH_MAX_WAIT_MS", "2"))
+MICRO_BATCH_MAX_QUEUE = int(os.environ.get("MICRO_BATCH_MAX_QUEUE", "1024"))
+
+# Single record predictions are cached for PREDICTION_CACHE_TTL seconds, with
+# at most PREDICTION_CACHE_SIZE entries kept. A size of 0 disables the cache.
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", "3600"))
+
+# Encoding and prediction run on a pool of PREDICT_POOL_SIZE threads so they
+# never stall the event loop. At most PREDICT_QUEUE_SIZE jobs wait for a free
+# thread, beyond that requests are turned away with a 503.
+PREDICT_POOL_SIZE = int(
+    os.environ.get("PREDICT_POOL_SIZE", str(os.cpu_count() or 1)))
+PREDICT_QUEUE_SIZE = int(os.environ.get("PREDICT_QUEUE_SIZE", "64"))
+
+registry = ModelRegistry(
+    model_pth=os.path.join(MODEL_DIR, "model.joblib"),
+    cat_encoder_pth=os.path.join(MODEL_DIR, "ohe.joblib"),
+    label_binarizer_pth=os.path.join(MODEL_DIR, "lb.joblib"),
+    compact_pth=os.path.join(MODEL_DIR, "compact"),
+    lookup_pth=os.path.join(MODEL_DIR, "lookup"))
+
+# Cached predictions of a previous model must not outlive a reload:
+cache = PredictionCache(
+    max_size=PREDICTION_CACHE_SIZE,
+    ttl=PREDICTION_CACHE_TTL)
+registry.add_listener(lambda artifacts: cache.clear())
+
+executor = BoundedExecutor(
+    max_workers=PREDICT_POOL_SIZE,
+    max_queue_size=PREDICT_QUEUE_SIZE)
+
+# Metrics are cheap enough to stay on in production: recording one
+# observation is a bisect and a lock, and samples are only formatted when
+# /metrics is scraped.
+metrics = MetricsRegistry()
+http_requests = metrics.counter(
+    "http_requests_total", "HTTP requests served.",
+    ["method", "path", "status"])
+http_latency = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency.",
+    ["method", "path"])
+http_in_flight = metrics.gauge(
+    "http_requests_in_flight", "HTTP requests being served.")
+stage_latency = metrics.histogram(
+    "inference_stage_duration_seconds", "Latency of every inference stage.",
+    ["stage"])
+batch_sizes = metrics.histogram(
+    "inference_batch_size", "Number of records predicted together.",
+    ["route"], buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096,
+                        16384))
+micro_batch_queue_depth = metrics.gauge(
+    "micro_batch_queue_depth", "Records waiting to be micro-batched.")
+executor_pending = metrics.gauge(
+    "predict_executor_pending", "Prediction jobs running or queued.")
+executor_rejected = metrics.counter(
+    "predict_executor_rejected_total", "Prediction jobs rejected with 503.")
+cache_size = metrics.gauge(
+    "prediction_cache_size", "Entries in the prediction cache.")
+cache_events = metrics.counter(
+    "prediction_cache_events_total", "Prediction cache lookups and removals.",
+    ["event"])
+lookup_events = metrics.counter(
+    "lookup_table_events_total", "Precomputed lookup table hits and misses.",
+    ["event"])
 
 app = FastAPI()
 
 
+async def _watch_artifacts():
+    """Periodically hot reload artifacts that changed on disk
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(MODEL_RELOAD_INTERVAL)
+        # Unpickling is slow, keep it off the event loop:
+        await loop.run_in_executor(None, registry.reload_if_changed)
+
+
+def _fetch_and_load_artifacts():
+    """Pull the artifacts when running on a dyno, then load them
+    """
+    pull_artifacts()
+    registry.load()
+
+
+def _start_loading_artifacts():
+    """Start fetching and loading the artifacts, unless already under way
+
+    A failed attempt is retried by the next call.
+
+    Returns
+    -------
+    future: asyncio.Future
+        Future completed once the artifacts are loaded.
+    """
+    future = getattr(app.state, "load_future", None)
+    if future is None or (future.done() and future.exception() is not None):
+        future = asyncio.get_event_loop().run_in_executor(
+            None, _fetch_and_load_artifacts)
+        app.state.load_future = future
+
+    return future
+
+
+async def _wait_for_artifacts():
+    """Wait until the artifacts are loaded, or turn the request away
+    """
+    if registry.loaded:
+        return
+
+    try:
+        # Shielded, so that a timed out request does not cancel the load:
+        await asyncio.wait_for(asyncio.shield(_start_loading_artifacts()),
+                               ARTIFACTS_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail="Model artifacts are still loading",
+            headers={"Retry-After": "1"})
+    except Exception:
+        logging.exception("Failed to load model artifacts")
+        raise HTTPException(
+            status_code=503,
+            detail="Model artifacts failed to load",
+            headers={"Retry-After": "1"})
+
+
+@app.on_event("startup")
+async def load_artifacts():
+    # Workers forked by the gunicorn master inherit the artifacts it loaded
+    # (see gunicorn.conf.py), only a standalone process fetches its own:
+    if not registry.loaded:
+        _start_loading_artifacts()
+    if MODEL_RELOAD_INTERVAL > 0:
+        app.state.reload_task = asyncio.get_event_loop().create_task(
+            _watch_artifacts())
+
+
+@app.on_event("shutdown")
+async def stop_watching_artifacts():
+    reload_task = getattr(app.state, "reload_task", None)
+    if reload_task is not None:
+        reload_task.cancel()
+
+
+@app.on_event("shutdown")
+async def stop_micro_batching():
+    await batcher.stop()
+    executor.shutdown()
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"})
+
+
 @app.get("/")
 async def get_items():
     return {"message": "Bonjour!"}
 
 
-@app.post("/")
-async def inference(user: User):
-
-    # Load estimator and encoders:
-    model = joblib.load("./model/model.joblib")
-    cat_encoder = joblib.load("./model/ohe.joblib")
-    label_binarizer = joblib.load("./model/lb.joblib")
-
-    # Get user data into numpy array:
-    user_arr = np.array([[
-        user.workclass,
-        user.education,
-        user.marital_status,
-        user.occupation,
-        user.relationship,
-        user.race,
-        user.sex,
-        user.native_country,
-        user.age,
-        user.education_num,
-        user.hours_per_week]])
-
-    # Get user data into pandas dataframe:
-    df_temp = pd.DataFrame(data=user_arr, columns=[
-        "workclass",
-        "education",
-        "marital-status",
-        "occupation",
-        "relationship",
-        "race",
-        "sex",
-        "native-country",
-        "age",
-        "education-num",
-        "hours-per-week"])
+def _columns_to_frame(columns):
+    """Build the model input dataframe from User field arrays
+
+    Parameters
+    ----------
+    columns: dictionary
+        Arrays of values keyed by User field name.
+
+    Returns
+    -------
+    df: pandas dataframe
+        Dataframe with the column names used during training.
+    """
+    feats = u.get_categorical_features() + u.get_numerical_features()
+
+    # User fields use underscores where the census columns use hyphens:
+    return pd.DataFrame({f: columns[f.replace("-", "_")] for f in feats})
+
+
+def _users_to_columns(users):
+    """Transpose a list of User records into arrays keyed by field name
+    """
+    return {field: [getattr(user, field) for user in users]
+            for field in User.__fields__}
+
+
+def _predictor(artifacts, n_rows):
+    """Get the fastest estimator for a batch of n_rows
+
+    Compact exports only hold the flat forest, which then serves every
+    batch.
+    """
+    if artifacts.model is None or \
+            (USE_FLAT_FOREST and n_rows <= FLAT_FOREST_MAX_ROWS):
+        return artifacts.forest
+
+    return artifacts.model
+
+
+def _predict_columns(columns):
+    """Encode and predict every record of a batch in one pass
+
+    Parameters
+    ----------
+    columns: dictionary
+        Arrays of values keyed by User field name.
+
+    Returns
+    -------
+    y_pred_labels: list of string
+        Predicted labels in the input order.
+    """
+    # Get estimator and encoders loaded at startup:
+    with stage_latency.time(stage="artifact_load"):
+        artifacts = registry.get()
+
+    with stage_latency.time(stage="dataframe_build"):
+        df = _columns_to_frame(columns)
+    batch_sizes.observe(len(df), route="batch")
 
     # Process user data:
+    with stage_latency.time(stage="process_data"):
+        X, _, _, _ = u.process_data(
+                    df=df,
+                    cat_features=u.get_categorical_features(),
+                    num_features=u.get_numerical_features(),
+                    training=False,
+                    cat_encoder=artifacts.cat_encoder,
+                    label_binarizer=artifacts.label_binarizer)
+
+    # Run inference to generate predictions:
+    with stage_latency.time(stage="predict"):
+        y_pred = u.inference(_predictor(artifacts, len(X)), X)
+    with stage_latency.time(stage="inverse_transform"):
+        y_pred_labels = artifacts.label_binarizer.inverse_transform(y_pred)
+
+    return y_pred_labels.tolist()
+
+
+def _predict_users(users):
+    """Predict a list of User records through the fast path encoder
+
+    Produces the same features as `_predict_columns` without building a
+    dataframe, which dominates the cost of small batches.
+    """
+    with stage_latency.time(stage="artifact_load"):
+        artifacts = registry.get()
+    batch_sizes.observe(len(users), route="micro_batch")
+
+    with stage_latency.time(stage="encode"):
+        X = artifacts.encoder.encode(users)
+    with stage_latency.time(stage="predict"):
+        y_pred = u.inference(_predictor(artifacts, len(X)), X)
+    with stage_latency.time(stage="inverse_transform"):
+        y_pred_labels = artifacts.label_binarizer.inverse_transform(y_pred)
+
+    return y_pred_labels.tolist()
+
+
+def _warm_up_users(n_users):
+    """Build valid User records cycling through every category
+    """
+    categories = sc.get_categories()
+    return [
+        User(age=20 + i % 60, education_num=1 + i % 16, hours_per_week=40,
+             **{feat.replace("-", "_"): cats[i % len(cats)]
+                for feat, cats in categories.items()})
+        for i in range(n_users)]
+
+
+def _warm_up(artifacts):
+    """Predict a synthetic batch with newly loaded artifacts
+
+    Runs the fast path encoder, the dataframe path and both estimators
+    once, so that the first real requests do not pay for lazy imports,
+    first touches of memory mapped pages and allocator growth. Stage
+    metrics are left untouched. Runs before the artifacts are swapped in,
+    so failures reject them and the previous snapshot keeps serving.
+    """
+    users = _warm_up_users(WARM_UP_SIZE)
+    X = artifacts.encoder.encode(users)
+    y_pred = u.inference(_predictor(artifacts, len(X)), X)
+    artifacts.label_binarizer.inverse_transform(y_pred)
+
     X, _, _, _ = u.process_data(
-                df=df_temp,
-                cat_features=u.get_categorical_features(),
-                num_features=u.get_numerical_features(),
-                training=False,
-                cat_encoder=cat_encoder,
-                label_binarizer=label_binarizer)
+        df=_columns_to_frame(_users_to_columns(users)),
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=artifacts.cat_encoder,
+        label_binarizer=artifacts.label_binarizer)
+    if artifacts.model is not None:
+        u.inference(artifacts.model, X)
+
+    logging.info(f"Warmed up model artifacts version {artifacts.version}")
+
+
+registry.add_check(_warm_up)
+
+
+async def _predict_stream_chunk(records):
+    """Predict a chunk of streamed records into NDJSON lines
+
+    Parameters
+    ----------
+    records: list of User or error
+        Valid records, or the error found in place of an invalid one.
+
+    Returns
+    -------
+    lines: string
+        One {"prediction": ...} or {"error": ...} line per record, in the
+        input order.
+    """
+    users = [r for r in records if isinstance(r, User)]
+    try:
+        predictions = iter(await executor.run(
+            lambda: _predict_columns(_users_to_columns(users)))
+            if users else [])
+    except QueueFullError as exc:
+        predictions = None
+        overloaded = str(exc)
+
+    lines = []
+    for record in records:
+        if not isinstance(record, User):
+            line = {"error": record}
+        elif predictions is None:
+            line = {"error": overloaded}
+        else:
+            line = {"prediction": next(predictions)}
+        lines.append(json.dumps(line, default=str) + "\n")
+
+    return "".join(lines)
+
+
+async def _stream_predictions(request):
+    """Read NDJSON records from the request and yield their predictions
+    """
+    records = []
+    try:
+        lines = iter_lines(request.stream(), STREAM_MAX_LINE_BYTES)
+        async for line in lines:
+            if not line.strip():
+                continue
+            try:
+                records.append(User.parse_raw(line))
+            except ValidationError as exc:
+                records.append(exc.errors())
+            if len(records) >= STREAM_CHUNK_SIZE:
+                yield await _predict_stream_chunk(records)
+                records = []
+    except LineTooLongError as exc:
+        records.append(str(exc))
+    except ClientDisconnect:
+        return
+
+    if records:
+        yield await _predict_stream_chunk(records)
+
 
-    # Run inference to generate prediction:
-    y_pred = u.inference(model, X)
-    y_pred_label = label_binarizer.inverse_transform(y_pred)[0]
+def _observe_validation(request):
+    """Record the time spent reading and validating the request body
+
+    The middleware stamps the request on arrival, so the time until the
+    handler runs is what FastAPI spent parsing and validating the body.
+    """
+    received_at = getattr(request.state, "received_at", None)
+    if received_at is not None:
+        stage_latency.observe(time.perf_counter() - received_at,
+                              stage="validation")
+
+
+batcher = MicroBatcher(
+    predict_fn=_predict_users,
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+    max_queue_size=MICRO_BATCH_MAX_QUEUE,
+    executor=executor)
+
+
+@app.get("/health/live")
+async def get_liveness():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def get_readiness():
+    if not registry.loaded:
+        # Retry a failed fetch or load instead of staying unready for good:
+        _start_loading_artifacts()
+        return JSONResponse(status_code=503, content={"status": "loading"})
+
+    return {"status": "ready", "version": registry.get().version}
+
+
+@app.get("/stats")
+async def get_stats():
+    lookup = registry.get().lookup if registry.loaded else None
+    return {
+        "micro_batching": batcher.stats(),
+        "executor": executor.stats(),
+        "prediction_cache": cache.stats(),
+        "lookup_table": lookup.stats() if lookup is not None else None,
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # Refresh the values maintained by other components before rendering:
+    micro_batch_queue_depth.set(batcher.queue_depth)
+    executor_stats = executor.stats()
+    executor_pending.set(executor_stats["pending"])
+    executor_rejected.set(executor_stats["rejected"])
+    cache_stats = cache.stats()
+    cache_size.set(cache_stats["size"])
+    for event in ["hits", "misses", "evictions", "expirations"]:
+        cache_events.set(cache_stats[event], event=event)
+    lookup = registry.get().lookup if registry.loaded else None
+    if lookup is not None:
+        lookup_stats = lookup.stats()
+        for event in ["hits", "misses"]:
+            lookup_events.set(lookup_stats[event], event=event)
+
+    return PlainTextResponse(metrics.render(),
+                             media_type=MetricsRegistry.CONTENT_TYPE)
+
+
+@app.post("/")
+async def inference(user: User, request: Request):
+    _observe_validation(request)
+    await _wait_for_artifacts()
+    artifacts = registry.get()
+    if artifacts.lookup is not None:
+        y_pred_label = artifacts.lookup.get(user)
+        if y_pred_label is not None:
+            return {"prediction": y_pred_label}
+
+    key = PredictionCache.make_key(user, artifacts.version)
+    y_pred_label = cache.get(key)
+    if y_pred_label is None:
+        y_pred_label = await batcher.submit(user)
+        cache.put(key, y_pred_label)
 
     return {"prediction": y_pred_label}
+
+
+@app.post("/batch")
+async def batch_inference(users: Union[List[User], UserColumns],
+                          request: Request):
+    _observe_validation(request)
+    if len(users) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch size {len(users)} exceeds the maximum of "
+                   f"{MAX_BATCH_SIZE} records")
+    if len(users) == 0:
+        return {"predictions": []}
+    await _wait_for_artifacts()
+
+    if isinstance(users, UserColumns):
+        predictions = await executor.run(
+            lambda: _predict_columns(users.dict()))
+    else:
+        predictions = await executor.run(
+            lambda: _predict_columns(_users_to_columns(users)))
+
+    return {"predictions": predictions}
+
+
+@app.post("/stream")
+async def stream_inference(request: Request):
+    await _wait_for_artifacts()
+    return DuplexStreamingResponse(_stream_predictions(request))
+
+
+# Added last so that the paths of every route above are known:
+app.add_middleware(
+    MetricsMiddleware,
+    requests=http_requests,
+    latency=http_latency,
+    in_flight=http_in_flight,
+    paths=[route.path for route in app.routes])
@@ -0,0 +1,45 @@
+"""Model artifacts fetching
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import logging
+import threading
+
+
+_lock = threading.Lock()
+_pulled = False
+
+
+def pull_artifacts():
+    """Pull the DVC tracked data and model artifacts on a Heroku dyno
+
+    Heroku slugs only hold the .dvc pointer files, so the artifacts have to
+    be pulled from the remote before the model can be loaded. The .dvc
+    directory is removed once pulled, so that later calls, from this or
+    any other process, do nothing. Outside of Heroku it does nothing either.
+
+    Returns
+    -------
+    pulled: bool
+        True if the artifacts were pulled by this call.
+
+    Raises
+    ------
+    RuntimeError
+        If dvc failed to pull, in which case the next call tries again.
+    """
+    global _pulled
+    with _lock:
+        if _pulled or "DYNO" not in os.environ or not os.path.isdir(".dvc"):
+            return False
+
+        logging.info("Pulling model artifacts with dvc ...")
+        os.system("dvc config core.no_scm true")
+        if os.system("dvc pull") != 0:
+            raise RuntimeError("dvc pull failed")
+        os.system("rm -r .dvc .apt/usr/lib/dvc")
+        _pulled = True
+
+    return True
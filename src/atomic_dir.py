@@ -0,0 +1,67 @@
+"""Atomic replacement of artifact directories
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import shutil
+import tempfile
+
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_dir(pth):
+    """Write a directory next to its target, then swap it into place
+
+    Serving processes memory map the .npy files of artifact directories.
+    Rewriting such a file in place changes, or truncates, the pages they
+    already mapped, so new artifacts are written to a fresh temporary
+    directory instead and renamed over the target once complete. Files of
+    the previous directory are unlinked, never modified, so mappings of
+    them stay valid until they are closed.
+
+    Parameters
+    ----------
+    pth: string
+        Target directory, replaced as a whole if it exists.
+
+    Yields
+    ------
+    tmp_pth: string
+        Empty directory to write the new content to. Removed if the block
+        raises, leaving the target untouched.
+    """
+    pth = os.path.abspath(pth)
+    parent, name = os.path.split(pth)
+    os.makedirs(parent, exist_ok=True)
+    tmp_pth = tempfile.mkdtemp(dir=parent, prefix=f".{name}.new.")
+    try:
+        yield tmp_pth
+        # mkdtemp only lets its owner in:
+        os.chmod(tmp_pth, 0o755)
+        _replace_dir(tmp_pth, pth)
+    except BaseException:
+        shutil.rmtree(tmp_pth, ignore_errors=True)
+        raise
+
+
+def _replace_dir(src, dst):
+    """Rename directory src to dst, replacing dst if it exists
+    """
+    try:
+        # Atomic when dst is missing or empty:
+        os.replace(src, dst)
+        return
+    except OSError:
+        if not os.path.isdir(dst):
+            raise
+
+    # A non-empty directory cannot be renamed over, so it is moved aside
+    # first. For the short time in between dst is missing, which loaders
+    # treat as no artifacts, never as a mix of old and new files:
+    parent, name = os.path.split(dst)
+    old = tempfile.mkdtemp(dir=parent, prefix=f".{name}.old.")
+    os.replace(dst, old)
+    os.replace(src, dst)
+    shutil.rmtree(old, ignore_errors=True)
@@ -3,8 +3,15 @@
 Author: Dan Sun
 Data: 2022-01-07
 """
+import os
+import shutil
+import logging
 import numpy as np
-import pandas as pd
+import src.data_cache as dc
+import src.schema as sc
+
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 
 
 def clean_data(df):
@@ -13,12 +20,19 @@ def clean_data(df):
     Parameters
     ----------
     df: pandas dataframe
-        This is the raw dataset.
+        This is the raw dataset. If read with `sc.read_csv`, "?" values are
+        already parsed as missing.
     """
-    # Drop rows containing "?" values:
-    df.replace(to_replace="?", value=np.nan, inplace=True)
+    # Drop rows containing "?" values, which only string columns may hold:
+    obj_cols = df.select_dtypes(include="object").columns
+    if len(obj_cols):
+        df[obj_cols] = df[obj_cols].replace(to_replace="?", value=np.nan)
     df.dropna(axis=0, inplace=True)
 
+    # Forget the categories which only appeared in dropped rows:
+    for col in df.select_dtypes(include="category").columns:
+        df[col] = df[col].cat.remove_unused_categories()
+
     # Drop columns containing too many zero values:
     df.drop(columns=["capital-loss", "capital-gain"], inplace=True)
 
@@ -28,15 +42,120 @@ def clean_data(df):
     return df
 
 
-def execute():
+def _clean_chunk(df):
+    """Clean a chunk of raw data read with `sc.read_csv`
+
+    Run in the worker processes of `clean_csv`, so that both cleaning and
+    CSV formatting are parallel, and only text is sent back.
+
+    Returns
+    -------
+    text: string
+        Clean rows in CSV format, without header.
+    columns: list of string
+        Columns of the clean rows.
+    counts: collections.Counter
+        Number of rows read and kept, and of rows dropped for a missing
+        value, in total and per column. A row missing several values counts
+        once in the total and once for every column.
+    """
+    missing = df.isna()
+    counts = Counter({
+        "rows read": len(df),
+        "rows dropped: missing values": int(missing.any(axis=1).sum()),
+    })
+    for col, n in missing.sum().items():
+        if n:
+            counts[f"rows dropped: missing {col}"] = int(n)
+
+    df = clean_data(df)
+    counts["rows kept"] = len(df)
+
+    return df.to_csv(index=False, header=False), list(df.columns), counts
+
+
+def clean_csv(raw_data_pth, clean_data_pth, chunksize=100000, n_jobs=None):
+    """Clean a raw CSV of any size chunk by chunk
+
+    Chunks are read in order, cleaned in a pool of processes and appended to
+    the output in their original order. At most two chunks per process are
+    in flight, so memory stays constant however large the input is.
+
+    Parameters
+    ----------
+    raw_data_pth: string
+        Path of the raw CSV.
+    clean_data_pth: string
+        Path of the clean CSV to write.
+    chunksize: int, default=100000
+        Number of rows read and cleaned at once.
+    n_jobs: int, default=None
+        Number of processes. If None, use all cores.
+
+    Returns
+    -------
+    counts: collections.Counter
+        Rows read, kept and dropped per rule, see `_clean_chunk`.
+    """
+    n_jobs = n_jobs or os.cpu_count()
+    reader = sc.read_csv(raw_data_pth, chunksize=chunksize)
+    counts = Counter()
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool, \
+            open(clean_data_pth, "w", newline="") as f:
+        max_pending = 2 * n_jobs
+        pending = deque()
+        header = True
+        chunks = iter(reader)
+        while True:
+            # Keep the pool busy while the oldest chunk is written:
+            for chunk in chunks:
+                pending.append(pool.submit(_clean_chunk, chunk))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+
+            text, columns, chunk_counts = pending.popleft().result()
+            if header:
+                f.write(",".join(columns) + "\n")
+                header = False
+            f.write(text)
+            counts.update(chunk_counts)
+            logging.info(f"Cleaned {counts['rows read']} rows")
+
+    for rule, n in sorted(counts.items()):
+        logging.info(f"{rule}: {n}")
+
+    return counts
+
+
+def execute(chunksize=None, n_jobs=None):
     """Execute basic data cleaning pipeline
+
+    Parameters
+    ----------
+    chunksize: int, default=None
+        If set, stream the raw data in chunks of this many rows through
+        `clean_csv`, for raw data larger than memory. The columnar cache
+        needs the whole clean dataset, so it is removed instead of rewritten
+        and rebuilt by the next `read_clean_data`.
+    n_jobs: int, default=None
+        Number of cleaning processes in chunked mode. If None, use all cores.
     """
     # Set up paths:
     RAW_DATA_PATH = "./data/raw_data/raw_census.csv"
     CLEAN_DATA_PATH = "./data/clean_data/clean_census.csv"
+    CLEAN_DATA_CACHE_PATH = "./data/clean_data/clean_census_cache"
+
+    if chunksize is not None:
+        clean_csv(RAW_DATA_PATH, CLEAN_DATA_PATH, chunksize=chunksize,
+                  n_jobs=n_jobs)
+        # Mapped column files stay readable until closed once unlinked:
+        shutil.rmtree(CLEAN_DATA_CACHE_PATH, ignore_errors=True)
+        return
 
     # Load raw data:
-    RAW_DATA = pd.read_csv(RAW_DATA_PATH, skipinitialspace=True)
+    RAW_DATA = sc.read_csv(RAW_DATA_PATH)
 
     # Clean raw data:
     CLEAN_DATA = clean_data(df=RAW_DATA)
@@ -44,6 +163,10 @@ def execute():
     # Save clean data:
     CLEAN_DATA.to_csv(CLEAN_DATA_PATH, index=False)
 
+    # Save columnar cache of clean data, tied to the CSV it replaces:
+    dc.save_frame(CLEAN_DATA, CLEAN_DATA_CACHE_PATH,
+                  dc.file_hash(CLEAN_DATA_PATH))
+
 
 if __name__ == "__main__":
     execute()
@@ -0,0 +1,128 @@
+"""Compact, memory mappable model artifacts
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from src.atomic_dir import atomic_dir
+from src.flat_forest import FlatForest
+
+
+def save_compact(model,
+                 cat_encoder,
+                 label_binarizer,
+                 pth,
+                 cat_features,
+                 num_features,
+                 source_hashes=None):
+    """Save the serving artifacts as flat arrays and a vocabulary file
+
+    The forest is saved as the node arrays of a FlatForest, which load with
+    `np.load(mmap_mode="r")`, so that every worker process maps the same
+    file pages instead of unpickling its own copy of the trees. Encoders are
+    reduced to their vocabularies in vocab.json.
+
+    Parameters
+    ----------
+    model: sklearn.ensemble._forest.RandomForestClassifier
+        Trained machine learning model.
+    cat_encoder: sklearn.preprocessing._encoders.OneHotEncoder
+        Trained sklearn one hot encoder.
+    label_binarizer: sklearn.preprocessing._label.LabelBinarizer
+        Trained sklearn label binarizer.
+    pth: string
+        Output directory.
+    cat_features: list of string
+        List of categorical feature names, in encoder column order.
+    num_features: list of string
+        List of numerical feature names.
+    source_hashes: list of string, default=None
+        Hashes of the files the artifacts were exported from, checked by
+        `load_compact` to detect a stale export.
+    """
+    if getattr(cat_encoder, "drop_idx_", None) is not None:
+        raise ValueError("Encoders dropping categories are not supported")
+
+    vocab = {
+        "source_hashes": source_hashes,
+        "n_features": int(model.n_features_in_),
+        "cat_features": list(cat_features),
+        "categories": [c.tolist() for c in cat_encoder.categories_],
+        "num_features": list(num_features),
+        "classes": label_binarizer.classes_.tolist(),
+    }
+    # Written to a fresh directory swapped in once complete, since serving
+    # processes memory map the arrays of the current export:
+    with atomic_dir(pth) as tmp_pth:
+        FlatForest.from_sklearn(model)._save_arrays(tmp_pth)
+        with open(os.path.join(tmp_pth, "vocab.json"), "w") as f:
+            json.dump(vocab, f, indent=2)
+
+
+def load_compact(pth, source_hashes=None, mmap_mode="r"):
+    """Load artifacts saved by `save_compact`
+
+    Encoders are rebuilt from their vocabularies, and transform exactly like
+    the fitted ones.
+
+    Parameters
+    ----------
+    pth: string
+        Directory written by `save_compact`.
+    source_hashes: list of string, default=None
+        Hashes of the current source files. If given and different from the
+        ones at export time, the export is stale and not loaded.
+    mmap_mode: string, default="r"
+        Memory map mode of the forest arrays, see `numpy.load`.
+
+    Returns
+    -------
+    forest: FlatForest
+        Memory mapped forest, or None if there is no valid export.
+    cat_encoder: sklearn.preprocessing._encoders.OneHotEncoder
+        Rebuilt one hot encoder.
+    label_binarizer: sklearn.preprocessing._label.LabelBinarizer
+        Rebuilt label binarizer.
+
+    Raises
+    ------
+    ValueError
+        If the encoded features do not match the ones the forest expects.
+    """
+    vocab_pth = os.path.join(pth, "vocab.json")
+    if not os.path.exists(vocab_pth):
+        return None, None, None
+    with open(vocab_pth) as f:
+        vocab = json.load(f)
+    if source_hashes is not None and vocab["source_hashes"] != source_hashes:
+        return None, None, None
+    # Exports predating the feature count are stale as well:
+    if "n_features" not in vocab:
+        return None, None, None
+
+    # Only the fallback to the joblib files needs sklearn otherwise:
+    from sklearn.preprocessing import OneHotEncoder, LabelBinarizer
+
+    # Fitting on one row per feature with fixed categories sets exactly the
+    # fitted attributes of the original encoder:
+    categories = [np.array(c, dtype=object) for c in vocab["categories"]]
+    cat_encoder = OneHotEncoder(categories=categories)
+    cat_encoder.fit(pd.DataFrame({
+        feat: [cats[0]]
+        for feat, cats in zip(vocab["cat_features"], categories)}))
+
+    label_binarizer = LabelBinarizer()
+    label_binarizer.fit(np.array(vocab["classes"], dtype=object))
+
+    forest = FlatForest.load(pth, mmap_mode=mmap_mode)
+    n_encoded = sum(len(c) for c in categories) + len(vocab["num_features"])
+    if n_encoded != vocab["n_features"]:
+        raise ValueError(
+            f"Encoders produce {n_encoded} features, but the exported forest "
+            f"is expecting {vocab['n_features']} features as input")
+
+    return forest, cat_encoder, label_binarizer
@@ -0,0 +1,158 @@
+"""Columnar binary cache of the clean dataset
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+import src.schema as sc
+
+from src.atomic_dir import atomic_dir
+
+
+def file_hash(pth, block_size=1 << 20):
+    """Hash the content of a file
+
+    Parameters
+    ----------
+    pth: string
+        Path of the file.
+    block_size: int, default=1 MiB
+        Number of bytes read at once.
+
+    Returns
+    -------
+    digest: string
+        Hexadecimal SHA-256 of the file.
+    """
+    h = hashlib.sha256()
+    with open(pth, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def _codes_dtype(n_categories):
+    """Smallest signed integer dtype holding every code, -1 being missing
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories <= np.iinfo(dtype).max:
+            return dtype
+
+    return np.int64
+
+
+def save_frame(df, cache_pth, source_hash):
+    """Save a dataframe as one .npy file per column
+
+    String columns are stored as integer category codes, with their
+    categories in meta.json, and numeric columns as they are. The directory
+    is replaced as a whole, see `src.atomic_dir`, so an interrupted save
+    never looks valid and processes that mapped the previous columns keep
+    reading them unchanged.
+
+    Parameters
+    ----------
+    df: pandas dataframe
+        Dataset to cache.
+    cache_pth: string
+        Directory of the cache, replaced if it exists.
+    source_hash: string
+        Hash of the file holding the same dataset, checked on load.
+    """
+    with atomic_dir(cache_pth) as tmp_pth:
+        _save_columns(df, tmp_pth, source_hash)
+
+
+def _save_columns(df, cache_pth, source_hash):
+    """Save the columns and meta.json of `save_frame` into a new directory
+    """
+    columns = []
+    for i, name in enumerate(df.columns):
+        column = df[name]
+        if pd.api.types.is_numeric_dtype(column):
+            values = column.to_numpy()
+            categories = None
+        else:
+            column = column.astype("category")
+            categories = column.cat.categories.tolist()
+            values = column.cat.codes.to_numpy().astype(
+                _codes_dtype(len(categories)))
+        np.save(os.path.join(cache_pth, f"{i}.npy"), values)
+        columns.append({"name": name, "categories": categories})
+
+    with open(os.path.join(cache_pth, "meta.json"), "w") as f:
+        json.dump({"source_hash": source_hash, "n_rows": len(df),
+                   "columns": columns}, f)
+
+
+def load_frame(cache_pth, source_hash, mmap_mode="r"):
+    """Load a dataframe saved by `save_frame`
+
+    Parameters
+    ----------
+    cache_pth: string
+        Directory of the cache.
+    source_hash: string
+        Hash of the current source file. The cache is stale if it was saved
+        from a different one.
+    mmap_mode: string, default="r"
+        Memory map mode of the column files, see `numpy.load`.
+
+    Returns
+    -------
+    df: pandas dataframe
+        Cached dataset with categorical string columns, or None if there is
+        no valid cache for this source.
+    """
+    meta_pth = os.path.join(cache_pth, "meta.json")
+    if not os.path.exists(meta_pth):
+        return None
+    with open(meta_pth) as f:
+        meta = json.load(f)
+    if meta["source_hash"] != source_hash:
+        logging.info(f"Cache {cache_pth} is stale, source has changed")
+        return None
+
+    data = {}
+    for i, column in enumerate(meta["columns"]):
+        values = np.load(os.path.join(cache_pth, f"{i}.npy"),
+                         mmap_mode=mmap_mode)
+        if column["categories"] is not None:
+            values = pd.Categorical.from_codes(values, column["categories"])
+        data[column["name"]] = values
+
+    return pd.DataFrame(data)
+
+
+def read_clean_data(clean_data_pth, cache_pth):
+    """Load the clean dataset, from its cache when valid
+
+    The cache is tied to the hash of the clean CSV itself, so any change to
+    that file, by basic cleaning or by hand, invalidates it. A missing or
+    stale cache is rebuilt from the CSV for the next read.
+
+    Parameters
+    ----------
+    clean_data_pth: string
+        Path of the clean CSV, read if the cache is missing or stale.
+    cache_pth: string
+        Directory of the cache.
+
+    Returns
+    -------
+    df: pandas dataframe
+        Clean dataset.
+    """
+    source_hash = file_hash(clean_data_pth)
+    df = load_frame(cache_pth, source_hash)
+    if df is None:
+        df = sc.read_csv(clean_data_pth)
+        save_frame(df, cache_pth, source_hash)
+
+    return df
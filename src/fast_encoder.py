@@ -0,0 +1,98 @@
+"""Fast path feature encoder for online inference
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import numpy as np
+
+
+class FastEncoder:
+    """Encode records straight into model feature rows
+
+    Produces exactly the matrix `process_data` builds with a fitted
+    OneHotEncoder, i.e. the one hot encoded categorical features followed by
+    the numerical features, but without going through pandas or sklearn.
+    Every categorical value is precompiled into the index of its one hot
+    column, so encoding a record only sets a handful of cells in a
+    preallocated float row.
+
+    Records are read by attribute, with the hyphens of the census column
+    names replaced by underscores, e.g. `native-country` is read from
+    `record.native_country`, which is how the API's User object names them.
+
+    Parameters
+    ----------
+    cat_features: list of string
+        List of categorical feature names.
+    categories: list of array
+        Categories of every categorical feature, in one hot column order.
+    num_features: list of string
+        List of numerical feature names.
+    """
+
+    def __init__(self, cat_features, categories, num_features):
+        self.cat_features = list(cat_features)
+        self.num_features = list(num_features)
+
+        # Map every (feature, category) to its column in the output row:
+        self._cat_columns = []
+        offset = 0
+        for feat, cats in zip(self.cat_features, categories):
+            columns = {c: offset + i for i, c in enumerate(cats)}
+            self._cat_columns.append((feat.replace("-", "_"), feat, columns))
+            offset += len(cats)
+
+        self._num_columns = [
+            (feat.replace("-", "_"), offset + i)
+            for i, feat in enumerate(self.num_features)]
+        self.n_features = offset + len(self.num_features)
+
+    @classmethod
+    def from_encoder(cls, cat_encoder, cat_features, num_features):
+        """Precompile a fitted OneHotEncoder
+
+        Parameters
+        ----------
+        cat_encoder: sklearn.preprocessing._encoders.OneHotEncoder
+            Trained sklearn one hot encoder.
+        cat_features: list of string
+            List of categorical feature names.
+        num_features: list of string
+            List of numerical feature names.
+
+        Returns
+        -------
+        encoder: FastEncoder
+            Encoder producing the same features as `process_data`.
+        """
+        if getattr(cat_encoder, "drop_idx_", None) is not None:
+            raise ValueError("Encoders dropping categories are not supported")
+
+        return cls(cat_features, cat_encoder.categories_, num_features)
+
+    def encode(self, records):
+        """Encode records into a feature matrix
+
+        Parameters
+        ----------
+        records: list of object
+            Records exposing every feature as an attribute.
+
+        Returns
+        -------
+        X: numpy array
+            Processed features, one row per record.
+        """
+        X = np.zeros((len(records), self.n_features))
+        for row, record in zip(X, records):
+            for field, feat, columns in self._cat_columns:
+                value = getattr(record, field)
+                try:
+                    row[columns[value]] = 1.0
+                except KeyError:
+                    raise ValueError(
+                        f"Found unknown category {value!r} in column {feat}")
+            for field, column in self._num_columns:
+                row[column] = getattr(record, field)
+
+        return X
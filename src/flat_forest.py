@@ -0,0 +1,265 @@
+"""Flat array based random forest evaluator
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import sys
+import numpy as np
+
+from src.atomic_dir import atomic_dir
+
+
+class FlatForest:
+    """Random forest flattened into contiguous node arrays
+
+    All trees are concatenated into one set of node arrays, and a batch is
+    evaluated by walking every (row, tree) pair one level per step with
+    vectorized numpy indexing. This replaces the per-estimator Python calls
+    and joblib thread dispatch of RandomForestClassifier.predict, which
+    dominate the cost of small batches.
+
+    Leaves point to themselves, so walking max_depth levels lands every pair
+    on its leaf regardless of the depth it sits at.
+
+    Parameters
+    ----------
+    feature: numpy array
+        Feature index tested by every node.
+    threshold: numpy array
+        Threshold of every node, rows go left when feature <= threshold.
+    children_left: numpy array
+        Global index of the left child of every node.
+    children_right: numpy array
+        Global index of the right child of every node.
+    value: numpy array
+        Class probabilities of every node, shape (n_nodes, n_classes).
+    roots: numpy array
+        Global index of the root node of every tree.
+    classes: numpy array
+        Class labels in probability column order.
+    max_depth: int
+        Depth of the deepest tree.
+    children: numpy array, default=None
+        Interleaved [right, left] children of every node, as saved by
+        `save`. If None, built from children_left and children_right.
+    n_features: int, default=None
+        Number of features the forest was trained on, checked against the
+        columns of every batch. If None, batches are not checked.
+    """
+
+    _ARRAYS = ["feature", "threshold", "value", "roots", "classes"]
+
+    def __init__(self,
+                 feature,
+                 threshold,
+                 children_left,
+                 children_right,
+                 value,
+                 roots,
+                 classes,
+                 max_depth,
+                 children=None,
+                 n_features=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children_left = children_left
+        self.children_right = children_right
+        self.value = value
+        self.roots = roots
+        self.classes = classes
+        self.max_depth = int(max_depth)
+        self.n_features = None if n_features is None else int(n_features)
+
+        # Interleave children so that the child of node i is found at
+        # 2 * i + go_left with a single take:
+        if children is None:
+            children = np.stack(
+                [children_right, children_left], axis=1).ravel()
+        self._children = children
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten a fitted sklearn RandomForestClassifier
+
+        Parameters
+        ----------
+        model: sklearn.ensemble._forest.RandomForestClassifier
+            Trained machine learning model.
+
+        Returns
+        -------
+        forest: FlatForest
+            Forest predicting the same classes as model.
+        """
+        feature, threshold, left, right, value, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left < 0
+
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            right.append(
+                np.where(is_leaf, nodes, tree.children_right) + offset)
+
+            # Normalize class counts to probabilities like
+            # DecisionTreeClassifier.predict_proba does:
+            counts = tree.value[:, 0, :]
+            normalizer = counts.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            value.append(counts / normalizer)
+
+            roots.append(offset)
+            offset += tree.node_count
+
+        return cls(
+            feature=np.concatenate(feature).astype(np.int32),
+            threshold=np.concatenate(threshold).astype(np.float64),
+            children_left=np.concatenate(left).astype(np.int32),
+            children_right=np.concatenate(right).astype(np.int32),
+            value=np.concatenate(value).astype(np.float64),
+            roots=np.array(roots, dtype=np.int32),
+            classes=np.asarray(model.classes_),
+            max_depth=max(e.tree_.max_depth for e in model.estimators_),
+            n_features=model.n_features_in_)
+
+    def predict_proba(self, X, chunk_size=256):
+        """Predict class probabilities
+
+        Parameters
+        ----------
+        X: numpy array or scipy.sparse matrix
+            Processed features. Sparse matrices are densified one chunk at
+            a time.
+        chunk_size: int, default=256
+            Number of rows walked at once, keeping the (rows, trees)
+            temporaries small enough to stay in cache.
+
+        Returns
+        -------
+        proba: numpy array
+            Class probabilities averaged over all trees.
+
+        Raises
+        ------
+        ValueError
+            If X does not have the number of features the forest was
+            trained on, which the node walk would otherwise read past.
+        """
+        # A sparse matrix implies scipy.sparse was imported by its creator,
+        # which serving dense features never does:
+        scipy_sparse = sys.modules.get("scipy.sparse")
+        is_sparse = scipy_sparse is not None and scipy_sparse.issparse(X)
+        X = X.tocsr() if is_sparse else np.asarray(X)
+        if self.n_features is not None and X.shape[1] != self.n_features:
+            raise ValueError(
+                f"X has {X.shape[1]} features, but FlatForest is expecting "
+                f"{self.n_features} features as input")
+        proba = np.empty((X.shape[0], self.value.shape[1]))
+        for start in range(0, X.shape[0], chunk_size):
+            X_chunk = X[start:start + chunk_size]
+            if is_sparse:
+                X_chunk = X_chunk.toarray()
+            # sklearn compares float32 features against float64 thresholds:
+            X_chunk = np.ascontiguousarray(X_chunk, dtype=np.float32)
+            n_rows, n_features = X_chunk.shape
+
+            # Offset of every row in the raveled chunk, so that the feature
+            # tested by each (row, tree) pair is a single flat take:
+            row_offsets = (np.arange(n_rows) * n_features)[:, None]
+            nodes = np.repeat(self.roots[None, :], n_rows, axis=0)
+            for _ in range(self.max_depth):
+                x = X_chunk.take(row_offsets + self.feature.take(nodes))
+                go_left = x <= self.threshold.take(nodes)
+                nodes = self._children.take(2 * nodes + go_left)
+
+            proba[start:start + chunk_size] = \
+                self.value.take(nodes, axis=0).sum(axis=1) / self.n_estimators
+
+        return proba
+
+    def predict(self, X):
+        """Predict classes, a drop-in replacement for model.predict
+
+        Parameters
+        ----------
+        X: numpy array or scipy.sparse matrix
+            Processed features.
+
+        Returns
+        -------
+        y_pred: numpy array
+            Predicted classes.
+        """
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def save(self, pth):
+        """Save the node arrays as .npy files in a directory
+
+        Children are saved interleaved, the layout `predict_proba` walks, so
+        a memory mapped load uses the file pages as they are. The directory
+        is replaced as a whole, see `src.atomic_dir`, so processes that
+        mapped the previous arrays keep reading them unchanged.
+
+        Parameters
+        ----------
+        pth: string
+            Output directory.
+        """
+        with atomic_dir(pth) as tmp_pth:
+            self._save_arrays(tmp_pth)
+
+    def _save_arrays(self, pth):
+        """Save the node arrays into an existing, not yet used, directory
+        """
+        for name in self._ARRAYS:
+            np.save(os.path.join(pth, f"{name}.npy"), getattr(self, name),
+                    allow_pickle=False)
+        np.save(os.path.join(pth, "children.npy"), self._children,
+                allow_pickle=False)
+        np.save(os.path.join(pth, "max_depth.npy"), np.array(self.max_depth))
+        if self.n_features is not None:
+            np.save(os.path.join(pth, "n_features.npy"),
+                    np.array(self.n_features))
+
+    @classmethod
+    def load(cls, pth, mmap_mode=None):
+        """Load node arrays saved by `save`
+
+        Parameters
+        ----------
+        pth: string
+            Directory written by `save`.
+        mmap_mode: string, default=None
+            Passed to np.load, use "r" to share the pages between processes.
+
+        Returns
+        -------
+        forest: FlatForest
+            Loaded forest.
+        """
+        # Plain ndarray views of the memory maps, since every operation on
+        # an np.memmap wraps its result in a memmap, doubling the cost of
+        # walking a small batch:
+        arrays = {
+            name: np.asarray(np.load(os.path.join(pth, f"{name}.npy"),
+                                     mmap_mode=mmap_mode, allow_pickle=False))
+            for name in cls._ARRAYS + ["children"]}
+        max_depth = np.load(os.path.join(pth, "max_depth.npy"))
+        n_features_pth = os.path.join(pth, "n_features.npy")
+        n_features = np.load(n_features_pth) \
+            if os.path.exists(n_features_pth) else None
+
+        # Left and right children are strided views of the same pages:
+        children = arrays["children"]
+        arrays["children_left"] = children[1::2]
+        arrays["children_right"] = children[0::2]
+
+        return cls(max_depth=max_depth, n_features=n_features, **arrays)
@@ -0,0 +1,320 @@
+"""Precomputed prediction table over packed integer keys
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+import src.utils as u
+
+from src.atomic_dir import atomic_dir
+
+
+class LookupTable:
+    """Model predictions of a fixed set of records, indexed by packed keys
+
+    Every record is packed into a single integer: the category code of every
+    categorical feature and the offset of every numerical feature from its
+    smallest tabulated value each take a fixed bit field. Keys are kept in a
+    sorted uint64 array searched with np.searchsorted, next to a uint8 array
+    of predicted classes, so a lookup costs a handful of dictionary reads
+    and one binary search instead of a walk through every tree.
+
+    Records are read by attribute, with the hyphens of the census column
+    names replaced by underscores, like `FastEncoder`.
+
+    Parameters
+    ----------
+    cat_features: list of string
+        List of categorical feature names.
+    categories: list of list
+        Categories of every categorical feature, in code order.
+    num_features: list of string
+        List of numerical feature names.
+    num_ranges: list of (int, int)
+        Smallest and largest tabulated value of every numerical feature.
+    keys: numpy array
+        Sorted packed keys.
+    values: numpy array
+        Index in classes of the prediction of every key.
+    classes: list of string
+        Predicted labels.
+    source_hashes: list of string, default=None
+        Hashes of the model artifacts the predictions were made with.
+    """
+
+    def __init__(self,
+                 cat_features,
+                 categories,
+                 num_features,
+                 num_ranges,
+                 keys,
+                 values,
+                 classes,
+                 source_hashes=None):
+        self.cat_features = list(cat_features)
+        self.categories = [list(c) for c in categories]
+        self.num_features = list(num_features)
+        self.num_ranges = [(int(low), int(high)) for low, high in num_ranges]
+        self.keys = keys
+        self.values = values
+        self.classes = list(classes)
+        self.source_hashes = source_hashes
+
+        # Bit field of every feature, categorical features first:
+        shift = 0
+        self._cat_fields = []
+        for feat, cats in zip(self.cat_features, self.categories):
+            codes = {c: i for i, c in enumerate(cats)}
+            self._cat_fields.append(
+                (feat, feat.replace("-", "_"), shift, codes))
+            shift += max(len(cats) - 1, 1).bit_length()
+        self._num_fields = []
+        for feat, (low, high) in zip(self.num_features, self.num_ranges):
+            self._num_fields.append(
+                (feat, feat.replace("-", "_"), shift, low, high))
+            shift += max(high - low, 1).bit_length()
+        if shift > 64:
+            raise ValueError(f"Packed keys need {shift} bits, more than 64")
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls,
+              df,
+              model,
+              cat_encoder,
+              label_binarizer,
+              cat_features,
+              num_features,
+              max_entries=None,
+              source_hashes=None):
+        """Predict the distinct records of a dataset into a table
+
+        Parameters
+        ----------
+        df: pandas dataframe
+            Records to tabulate, e.g. the clean dataset or logged traffic.
+        model: sklearn.ensemble._forest.RandomForestClassifier
+            Trained machine learning model.
+        cat_encoder: sklearn.preprocessing._encoders.OneHotEncoder
+            Trained sklearn one hot encoder.
+        label_binarizer: sklearn.preprocessing._label.LabelBinarizer
+            Trained sklearn label binarizer.
+        cat_features: list of string
+            List of categorical feature names.
+        num_features: list of string
+            List of numerical feature names.
+        max_entries: int, default=None
+            If set, only keep the most frequent distinct records.
+        source_hashes: list of string, default=None
+            Hashes of the model artifacts, checked by `load`.
+
+        Returns
+        -------
+        table: LookupTable
+            Table of the predictions of the distinct records.
+        """
+        feats = cat_features + num_features
+        counts = df.groupby(feats, observed=True).size()
+        counts = counts.sort_values(ascending=False, kind="stable")
+        if max_entries is not None:
+            counts = counts.iloc[:max_entries]
+        records = counts.index.to_frame(index=False)
+
+        X, _, _, _ = u.process_data(
+            df=records,
+            cat_features=cat_features,
+            num_features=num_features,
+            training=False,
+            cat_encoder=cat_encoder,
+            label_binarizer=label_binarizer)
+        y_pred = np.searchsorted(model.classes_, model.predict(X))
+        classes = label_binarizer.inverse_transform(model.classes_)
+
+        table = cls(
+            cat_features=cat_features,
+            categories=[c.tolist() for c in cat_encoder.categories_],
+            num_features=num_features,
+            num_ranges=[(records[f].min(), records[f].max())
+                        for f in num_features],
+            keys=np.empty(0, dtype=np.uint64),
+            values=np.empty(0, dtype=np.uint8),
+            classes=classes.tolist(),
+            source_hashes=source_hashes)
+        keys = table.pack_frame(records)
+        order = np.argsort(keys)
+        table.keys = keys[order]
+        table.values = y_pred[order].astype(np.uint8)
+
+        return table
+
+    def pack_frame(self, df):
+        """Pack every row of a dataframe into its key
+
+        Parameters
+        ----------
+        df: pandas dataframe
+            Records with every categorical and numerical feature, within the
+            categories and ranges of the table.
+
+        Returns
+        -------
+        keys: numpy array
+            Packed uint64 key of every row.
+        """
+        keys = np.zeros(len(df), dtype=np.uint64)
+        for feat, _, shift, codes in self._cat_fields:
+            cat_codes = pd.Categorical(
+                df[feat], categories=list(codes)).codes
+            if (cat_codes < 0).any():
+                raise ValueError(f"Found unknown category in column {feat}")
+            keys |= cat_codes.astype(np.uint64) << np.uint64(shift)
+        for feat, _, shift, low, _ in self._num_fields:
+            offsets = df[feat].to_numpy().astype(np.int64) - low
+            keys |= offsets.astype(np.uint64) << np.uint64(shift)
+
+        return keys
+
+    def pack(self, record):
+        """Pack a record into its key
+
+        Returns
+        -------
+        key: int
+            Packed key, or None if a value is outside the table domain.
+        """
+        key = 0
+        for _, field, shift, codes in self._cat_fields:
+            code = codes.get(getattr(record, field))
+            if code is None:
+                return None
+            key |= code << shift
+        for _, field, shift, low, high in self._num_fields:
+            value = getattr(record, field)
+            if not low <= value <= high:
+                return None
+            key |= (value - low) << shift
+
+        return key
+
+    def get(self, record):
+        """Get the tabulated prediction of a record
+
+        Parameters
+        ----------
+        record: object
+            Record exposing every feature as an attribute.
+
+        Returns
+        -------
+        label: string
+            Predicted label, or None if the record is not in the table.
+        """
+        label = None
+        key = self.pack(record)
+        if key is not None and len(self.keys):
+            # np.uint64 keeps the comparison exact, a Python int would be
+            # compared as a float64 against the uint64 array:
+            key = np.uint64(key)
+            i = int(np.searchsorted(self.keys, key))
+            if i < len(self.keys) and self.keys[i] == key:
+                label = self.classes[self.values[i]]
+
+        with self._lock:
+            if label is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+
+        return label
+
+    def stats(self):
+        """Get the size and hit rate of the table
+
+        Returns
+        -------
+        stats: dictionary
+            Number of entries, hits, misses and hit rate.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self.keys),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+    def save(self, pth):
+        """Save the table as .npy arrays and a meta.json file
+
+        The directory is replaced as a whole, see `src.atomic_dir`, so
+        processes that mapped the previous arrays keep reading them
+        unchanged.
+
+        Parameters
+        ----------
+        pth: string
+            Output directory.
+        """
+        meta = {
+            "source_hashes": self.source_hashes,
+            "cat_features": self.cat_features,
+            "categories": self.categories,
+            "num_features": self.num_features,
+            "num_ranges": self.num_ranges,
+            "classes": self.classes,
+        }
+        with atomic_dir(pth) as tmp_pth:
+            np.save(os.path.join(tmp_pth, "keys.npy"), self.keys,
+                    allow_pickle=False)
+            np.save(os.path.join(tmp_pth, "values.npy"), self.values,
+                    allow_pickle=False)
+            with open(os.path.join(tmp_pth, "meta.json"), "w") as f:
+                json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, pth, source_hashes=None, mmap_mode="r"):
+        """Load a table saved by `save`
+
+        Parameters
+        ----------
+        pth: string
+            Directory written by `save`.
+        source_hashes: list of string, default=None
+            Hashes of the current model artifacts. If given and different
+            from the ones the table was built with, the table is stale and
+            not loaded.
+        mmap_mode: string, default="r"
+            Memory map mode of the arrays, see `numpy.load`.
+
+        Returns
+        -------
+        table: LookupTable
+            Loaded table, or None if there is no valid table.
+        """
+        meta_pth = os.path.join(pth, "meta.json")
+        if not os.path.exists(meta_pth):
+            return None
+        with open(meta_pth) as f:
+            meta = json.load(f)
+        stale = meta["source_hashes"] != source_hashes
+        if source_hashes is not None and stale:
+            return None
+
+        # Plain ndarray views of the memory maps, see FlatForest.load:
+        keys, values = [
+            np.asarray(np.load(os.path.join(pth, f"{name}.npy"),
+                               mmap_mode=mmap_mode, allow_pickle=False))
+            for name in ["keys", "values"]]
+
+        return cls(keys=keys, values=values, **meta)
@@ -0,0 +1,240 @@
+"""Prometheus style metrics
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import time
+import bisect
+import threading
+
+from contextlib import contextmanager
+
+
+# Latency buckets in seconds, finer than the Prometheus defaults since most
+# inference stages take well under a millisecond:
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(labelnames, key, extra=None):
+    """Format label values as {name="value",...}
+    """
+    pairs = list(zip(labelnames, key))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{n}="{str(v)}"' for n, v in pairs)
+
+    return "{" + inner + "}"
+
+
+class _Metric:
+    """Base of all metrics: a value per combination of label values
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[n] for n in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(f"{self.name}{_format_labels(self.labelnames, key)}", v)
+                    for key, v in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name} {value}" for name, value in self._samples()]
+
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count
+    """
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Set the total of a count maintained elsewhere, e.g. cache hits
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Gauge(_Metric):
+    """Value that goes up and down
+    """
+
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed upper bound buckets
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = \
+                    [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time spent in a with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(counts), total)
+                     for key, (counts, total) in sorted(self._values.items())]
+        for key, counts, total in items:
+            cumulative = 0
+            bounds = [str(b) for b in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", bound))
+                samples.append((f"{self.name}_bucket{labels}", cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f"{self.name}_sum{labels}", total))
+            samples.append((f"{self.name}_count{labels}", cumulative))
+
+        return samples
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the text exposition format
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=LATENCY_BUCKETS):
+        return self._register(
+            Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Render every metric
+
+        Returns
+        -------
+        text: string
+            Metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing every HTTP request
+
+    A plain ASGI middleware rather than a BaseHTTPMiddleware, which would
+    add a task and a body copy to every request.
+
+    Parameters
+    ----------
+    app: ASGI application
+        Wrapped application.
+    requests: Counter
+        Counter labelled by method, path and status.
+    latency: Histogram
+        Latency histogram labelled by method and path.
+    in_flight: Gauge
+        Gauge of requests being served.
+    paths: collection of string
+        Paths reported as is, any other path is reported as "other" to
+        bound the number of label values.
+    """
+
+    def __init__(self, app, requests, latency, in_flight, paths):
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        self.in_flight = in_flight
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        path = scope["path"] if scope["path"] in self.paths else "other"
+        status = {"code": 500}
+        start = time.perf_counter()
+        # Exposed to handlers so they can time the work done before them:
+        scope.setdefault("state", {})["received_at"] = start
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        self.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.in_flight.dec()
+            self.latency.observe(time.perf_counter() - start,
+                                 method=method, path=path)
+            self.requests.inc(method=method, path=path, status=status["code"])
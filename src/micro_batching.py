@@ -0,0 +1,216 @@
+"""Dynamic micro-batching of concurrent prediction requests
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import asyncio
+import bisect
+import logging
+
+from src.prediction_executor import QueueFullError
+
+
+class _Histogram:
+    """Count observations falling into fixed upper bound buckets
+    """
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+    def to_dict(self):
+        keys = [str(b) for b in self.bounds] + ["+Inf"]
+        return dict(zip(keys, self.counts))
+
+
+def _power_of_two_bounds(limit):
+    """Get 1, 2, 4, ... up to and including limit
+    """
+    bounds = [1]
+    while bounds[-1] < limit:
+        bounds.append(min(bounds[-1] * 2, limit))
+
+    return bounds
+
+
+class MicroBatcher:
+    """Coalesce concurrent single record predictions into one batch
+
+    Requests are queued and a single worker task drains the queue: it waits
+    at most max_wait_ms after the first queued record, or until
+    max_batch_size records are gathered, then predicts them as one matrix
+    and resolves each caller's future with its own result.
+
+    Parameters
+    ----------
+    predict_fn: callable
+        Function mapping a list of records to a list of predictions of the
+        same length and order.
+    max_batch_size: int, default=64
+        Largest number of records predicted together.
+    max_wait_ms: float, default=2.0
+        Longest time the first record of a batch waits for company.
+    max_queue_size: int, default=0
+        Largest number of records waiting to be predicted, 0 means no limit.
+        Submitting to a full queue raises QueueFullError.
+    executor: src.prediction_executor.BoundedExecutor, default=None
+        Executor running predict_fn off the event loop. While a batch is
+        predicting the next one is already being gathered. If None,
+        predict_fn runs on the event loop.
+    """
+
+    def __init__(self,
+                 predict_fn,
+                 max_batch_size=64,
+                 max_wait_ms=2.0,
+                 max_queue_size=0,
+                 executor=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.executor = executor
+        self._queue = None
+        self._task = None
+        self._in_flight = set()
+        self._batch_sizes = _Histogram(_power_of_two_bounds(max_batch_size))
+        self._queue_depths = _Histogram(
+            _power_of_two_bounds(max(max_queue_size, 1024)))
+
+    def _ensure_started(self):
+        """Start the worker task on the running event loop
+        """
+        if self._task is None or self._task.done():
+            # The queue binds to the event loop it is first used on, so it is
+            # created together with the worker task:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    @property
+    def queue_depth(self):
+        return 0 if self._queue is None else self._queue.qsize()
+
+    async def submit(self, record):
+        """Queue one record and wait for its prediction
+
+        Parameters
+        ----------
+        record: object
+            Record passed to predict_fn.
+
+        Returns
+        -------
+        prediction: object
+            Prediction of predict_fn for this record.
+        """
+        self._ensure_started()
+        future = asyncio.get_event_loop().create_future()
+        try:
+            self._queue.put_nowait((record, future))
+        except asyncio.QueueFull:
+            raise QueueFullError(
+                f"Prediction queue is full ({self.max_queue_size} records)")
+
+        return await future
+
+    async def _fill_batch(self, batch):
+        """Wait for the first record, then gather more until full or timed out
+        """
+        batch.append(await self._queue.get())
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            # Drain whatever is already queued before waiting for more:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(
+                    await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        batch = []
+        try:
+            while True:
+                batch = []
+                await self._fill_batch(batch)
+                self._queue_depths.observe(self._queue.qsize())
+                self._batch_sizes.observe(len(batch))
+                if self.executor is None:
+                    await self._predict(batch)
+                    continue
+                task = asyncio.get_event_loop().create_task(
+                    self._predict(batch))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+        except asyncio.CancelledError:
+            # Do not leave callers of a half gathered batch waiting forever:
+            for _, future in batch:
+                future.cancel()
+            raise
+
+    async def _predict(self, batch):
+        """Predict a batch and resolve the future of every caller
+        """
+        records = [record for record, _ in batch]
+        try:
+            if self.executor is None:
+                predictions = self.predict_fn(records)
+            else:
+                predictions = await self.executor.run(
+                    self.predict_fn, records)
+        except Exception as e:
+            if not isinstance(e, QueueFullError):
+                logging.exception("Micro-batch prediction failed")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), prediction in zip(batch, predictions):
+            # Callers that disconnected have their futures cancelled:
+            if not future.done():
+                future.set_result(prediction)
+
+    async def stop(self):
+        """Stop the worker task and fail any record still queued
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Let batches already handed to the executor finish:
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+        self._task = None
+        self._queue = None
+
+    def stats(self):
+        """Get queue depth and batch size statistics
+
+        Returns
+        -------
+        stats: dictionary
+            Current queue depth and histograms of batch sizes and of queue
+            depths observed whenever a batch was dispatched.
+        """
+        return {
+            "queue_depth": self.queue_depth,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batch_size_histogram": self._batch_sizes.to_dict(),
+            "queue_depth_histogram": self._queue_depths.to_dict(),
+        }
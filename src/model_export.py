@@ -0,0 +1,59 @@
+"""Model export pipeline
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import logging
+import joblib
+import src.utils as u
+
+from src.compact_model import save_compact
+from src.data_cache import file_hash
+
+
+def export_compact(model_pth, cat_encoder_pth, label_binarizer_pth,
+                   compact_pth):
+    """Export the serving artifacts to the compact format
+
+    Parameters
+    ----------
+    model_pth: string
+        Path of the trained model.
+    cat_encoder_pth: string
+        Path of the trained categorical encoder.
+    label_binarizer_pth: string
+        Path of the trained label binarizer.
+    compact_pth: string
+        Directory to save the flattened forest and encoder vocabularies.
+    """
+    source_pths = [model_pth, cat_encoder_pth, label_binarizer_pth]
+    save_compact(
+        model=joblib.load(model_pth),
+        cat_encoder=joblib.load(cat_encoder_pth),
+        label_binarizer=joblib.load(label_binarizer_pth),
+        pth=compact_pth,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        source_hashes=[file_hash(pth) for pth in source_pths])
+    logging.info(f"Exported compact model artifacts to {compact_pth}")
+
+
+def execute():
+    """Execute model export pipeline
+    """
+    # Set up paths:
+    MODEL_PATH = "./model/model.joblib"
+    CAT_ENCODER_PATH = "./model/ohe.joblib"
+    LABEL_BINARIZER_PATH = "./model/lb.joblib"
+    COMPACT_PATH = "./model/compact"
+
+    # Execute model export pipeline:
+    export_compact(
+        model_pth=MODEL_PATH,
+        cat_encoder_pth=CAT_ENCODER_PATH,
+        label_binarizer_pth=LABEL_BINARIZER_PATH,
+        compact_pth=COMPACT_PATH)
+
+
+if __name__ == "__main__":
+    execute()
@@ -5,8 +5,9 @@ Date: 2022-01-07
 """
 import logging
 import joblib
-import pandas as pd
+import numpy as np
 import src.utils as u
+import src.data_cache as dc
 
 from sklearn.model_selection import train_test_split
 
@@ -15,11 +16,13 @@ def inference_score(df,
                     model_pth,
                     cat_encoder_pth,
                     label_binarizer_pth,
-                    slice_metrics_pth):
+                    slice_metrics_pth,
+                    slice_metrics_json_pth=None):
     """Calculate inference score on sliced data
 
     For simplicity, the function just output the performance on slices of
-    categorical features.
+    categorical features. The validation set is encoded and predicted once,
+    and every slice is scored from the same predictions.
 
     Parameters
     ----------
@@ -31,6 +34,14 @@ def inference_score(df,
         Path of the pre-trained label binarizer.
     slice_metrics_pth: string
         Path to save the metrics on sliced data.
+    slice_metrics_json_pth: string, default=None
+        Path to also save the metrics on sliced data as machine readable
+        JSON records. Skipped if None.
+
+    Returns
+    -------
+    slice_metrics: pandas dataframe
+        Metrics of every slice.
     """
     # Split dataset into training and validation set:
     _, df_valid = train_test_split(df, test_size=0.20)
@@ -40,41 +51,41 @@ def inference_score(df,
     ohe = joblib.load(cat_encoder_pth)
     lb = joblib.load(label_binarizer_pth)
 
+    X_valid, y_valid, _, _ = u.process_data(
+        df=df_valid,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=ohe,
+        label_binarizer=lb,
+        sparse=True,
+        dtype=np.float32
+    )
+
+    # Generate predictions on validation set:
+    y_pred = model.predict(X_valid)
+
     # Calculate model performance on sliced categorical features:
-    slice_values = []
-    cat_feats = u.get_categorical_features()
-    for cat_feat in cat_feats:
-        for category in df_valid[cat_feat].unique():
-
-            # Grab rows within the same category:
-            df_temp = df_valid[df_valid[cat_feat] == category]
-
-            X_valid, y_valid, _, _ = u.process_data(
-                df=df_temp,
-                cat_features=u.get_categorical_features(),
-                num_features=u.get_numerical_features(),
-                training=False,
-                cat_encoder=ohe,
-                label_binarizer=lb
-            )
-
-            # Generate predictions on validation set:
-            y_pred = model.predict(X_valid)
-
-            # Calculate metrics on validation set:
-            acc, recall, precision = u.calculate_metrics(
-                y_valid, y_pred)
-
-            # Log model performance on sliced data:
-            _ = (f"[{cat_feat} - {category}], Accuracy={acc:.3f}, "
-                 f"Recall={recall:.3f}, Precision={precision:.3f}")
-            logging.info(_)
-            slice_values.append(_)
+    slice_metrics = u.calculate_slice_metrics(
+        df=df_valid,
+        y_true=y_valid,
+        y_pred=y_pred,
+        cat_features=u.get_categorical_features())
 
     # Log sliced metrics value into a txt file:
     with open(slice_metrics_pth, "w") as f:
-        for v in slice_values:
-            f.write(v + "\n")
+        for row in slice_metrics.itertuples():
+            _ = (f"[{row.feature} - {row.category}], "
+                 f"Accuracy={row.accuracy:.3f}, "
+                 f"Recall={row.recall:.3f}, Precision={row.precision:.3f}")
+            logging.info(_)
+            f.write(_ + "\n")
+
+    if slice_metrics_json_pth is not None:
+        slice_metrics.to_json(slice_metrics_json_pth, orient="records",
+                              indent=2)
+
+    return slice_metrics
 
 
 def execute():
@@ -82,13 +93,16 @@ def execute():
     """
     # Set up paths:
     CLEAN_DATA_PATH = "./data/clean_data/clean_census.csv"
+    CLEAN_DATA_CACHE_PATH = "./data/clean_data/clean_census_cache"
     SCORE_TXT_PATH = "./model/slice_metrics.txt"
+    SCORE_JSON_PATH = "./model/slice_metrics.json"
     MODEL_PATH = "./model/model.joblib"
     CAT_ENCODER_PATH = "./model/ohe.joblib"
     LABEL_BINARIZER_PATH = "./model/lb.joblib"
 
     # Load clean data:
-    CLEAN_DATA = pd.read_csv(CLEAN_DATA_PATH, skipinitialspace=True)
+    CLEAN_DATA = dc.read_clean_data(
+        CLEAN_DATA_PATH, CLEAN_DATA_CACHE_PATH)
 
     # Execute inference pipeline:
     inference_score(
@@ -96,7 +110,8 @@ def execute():
         model_pth=MODEL_PATH,
         cat_encoder_pth=CAT_ENCODER_PATH,
         label_binarizer_pth=LABEL_BINARIZER_PATH,
-        slice_metrics_pth=SCORE_TXT_PATH
+        slice_metrics_pth=SCORE_TXT_PATH,
+        slice_metrics_json_pth=SCORE_JSON_PATH
     )
 
 
@@ -0,0 +1,68 @@
+"""Lookup table precompute pipeline
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import logging
+import joblib
+import src.schema as sc
+import src.utils as u
+
+from src.data_cache import file_hash
+from src.lookup_table import LookupTable
+
+
+def precompute_table(data_pth, model_pth, cat_encoder_pth,
+                     label_binarizer_pth, lookup_pth, max_entries=None):
+    """Precompute the predictions of the distinct records of a dataset
+
+    Parameters
+    ----------
+    data_pth: string
+        Path of the records to tabulate, e.g. the clean dataset.
+    model_pth: string
+        Path of the trained model.
+    cat_encoder_pth: string
+        Path of the trained categorical encoder.
+    label_binarizer_pth: string
+        Path of the trained label binarizer.
+    lookup_pth: string
+        Directory to save the lookup table.
+    max_entries: int, default=None
+        If set, only tabulate the most frequent distinct records.
+    """
+    source_pths = [model_pth, cat_encoder_pth, label_binarizer_pth]
+    table = LookupTable.build(
+        df=sc.read_csv(data_pth),
+        model=joblib.load(model_pth),
+        cat_encoder=joblib.load(cat_encoder_pth),
+        label_binarizer=joblib.load(label_binarizer_pth),
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        max_entries=max_entries,
+        source_hashes=[file_hash(pth) for pth in source_pths])
+    table.save(lookup_pth)
+    logging.info(f"Precomputed {len(table)} predictions to {lookup_pth}")
+
+
+def execute(input_pth, max_entries=None):
+    """Execute lookup table precompute pipeline
+    """
+    # Set up paths:
+    MODEL_PATH = "./model/model.joblib"
+    CAT_ENCODER_PATH = "./model/ohe.joblib"
+    LABEL_BINARIZER_PATH = "./model/lb.joblib"
+    LOOKUP_PATH = "./model/lookup"
+
+    # Execute lookup table precompute pipeline:
+    precompute_table(
+        data_pth=input_pth,
+        model_pth=MODEL_PATH,
+        cat_encoder_pth=CAT_ENCODER_PATH,
+        label_binarizer_pth=LABEL_BINARIZER_PATH,
+        lookup_pth=LOOKUP_PATH,
+        max_entries=max_entries)
+
+
+if __name__ == "__main__":
+    execute(input_pth="./data/clean_data/clean_census.csv")
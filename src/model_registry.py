@@ -0,0 +1,254 @@
+"""Model registry
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import logging
+import threading
+import src.utils as u
+
+from collections import namedtuple
+from src.compact_model import load_compact
+from src.data_cache import file_hash
+from src.fast_encoder import FastEncoder
+from src.flat_forest import FlatForest
+from src.lookup_table import LookupTable
+
+
+# Immutable snapshot of everything needed to serve one prediction. Requests
+# grab a reference to a snapshot and keep using it even if a reload swaps in
+# a newer one halfway through. The sklearn model is None when the artifacts
+# come from a compact export, which only holds the flat forest, and the
+# lookup table is None unless a table was precomputed with this model.
+Artifacts = namedtuple("Artifacts", [
+    "model",
+    "cat_encoder",
+    "label_binarizer",
+    "encoder",
+    "forest",
+    "lookup",
+    "version",
+])
+
+
+class ModelRegistry:
+    """Load the serving artifacts once and share them across requests
+
+    Parameters
+    ----------
+    model_pth: string
+        Path of the trained model.
+    cat_encoder_pth: string
+        Path of the trained categorical encoder.
+    label_binarizer_pth: string
+        Path of the trained label binarizer.
+    compact_pth: string, default=None
+        Directory of a compact export of the same artifacts, see
+        `src.compact_model`. Preferred over the joblib files when it was
+        exported from their current version, or when they are missing.
+    lookup_pth: string, default=None
+        Directory of a precomputed `LookupTable`, loaded under the same
+        conditions as the compact export.
+    """
+
+    def __init__(self, model_pth, cat_encoder_pth, label_binarizer_pth,
+                 compact_pth=None, lookup_pth=None):
+        self.paths = (model_pth, cat_encoder_pth, label_binarizer_pth)
+        self.compact_pth = compact_pth
+        self.lookup_pth = lookup_pth
+        self._artifacts = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._checks = []
+
+    def _file_signature(self):
+        """Get modification time and size of every artifact file
+        """
+        pths = list(self.paths)
+        if self.compact_pth is not None:
+            pths.append(os.path.join(self.compact_pth, "vocab.json"))
+        if self.lookup_pth is not None:
+            pths.append(os.path.join(self.lookup_pth, "meta.json"))
+
+        signature = []
+        for pth in pths:
+            if not os.path.exists(pth):
+                signature.append(None)
+                continue
+            stat = os.stat(pth)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+
+        return tuple(signature)
+
+    def _source_hashes(self):
+        """Hash the joblib files, which derived artifacts must match
+
+        Returns
+        -------
+        source_hashes: list of string
+            Hash of every joblib file, or None if any is missing, in which
+            case derived artifacts are trusted as they are.
+        """
+        if not all(os.path.exists(pth) for pth in self.paths):
+            return None
+
+        return [file_hash(pth) for pth in self.paths]
+
+    def _load_compact(self, source_hashes):
+        """Load the compact export if it matches the joblib files
+
+        Returns
+        -------
+        forest, cat_encoder, label_binarizer: tuple
+            Loaded artifacts, all None if there is no up to date export.
+        """
+        if self.compact_pth is None:
+            return None, None, None
+
+        forest, cat_encoder, label_binarizer = load_compact(
+            self.compact_pth, source_hashes)
+        if forest is None and os.path.exists(self.compact_pth):
+            logging.warning(f"Ignoring stale or incomplete compact export "
+                            f"in {self.compact_pth}")
+
+        return forest, cat_encoder, label_binarizer
+
+    def _load_lookup(self, source_hashes):
+        """Load the lookup table if it was built with the joblib files
+
+        Returns
+        -------
+        lookup: LookupTable
+            Loaded table, or None if there is no up to date table.
+        """
+        if self.lookup_pth is None:
+            return None
+
+        lookup = LookupTable.load(self.lookup_pth, source_hashes)
+        if lookup is None and os.path.exists(self.lookup_pth):
+            logging.warning(f"Ignoring stale or incomplete lookup table in "
+                            f"{self.lookup_pth}")
+
+        return lookup
+
+    def add_listener(self, fn):
+        """Register a callable run with the new artifacts after every load
+
+        Parameters
+        ----------
+        fn: callable
+            Function taking the newly loaded Artifacts, e.g. to invalidate
+            anything derived from the previous ones.
+        """
+        self._listeners.append(fn)
+
+    def add_check(self, fn):
+        """Register a callable run with candidate artifacts before every swap
+
+        Parameters
+        ----------
+        fn: callable
+            Function taking the candidate Artifacts, e.g. to warm them up
+            with a prediction. Raising rejects the candidate, which is then
+            never served, and the previous snapshot keeps serving.
+        """
+        self._checks.append(fn)
+
+    @property
+    def loaded(self):
+        return self._artifacts is not None
+
+    def load(self):
+        """Load artifacts from disk, check them and atomically swap them in
+
+        Raises whatever a check registered with `add_check` raises, in which
+        case the previous snapshot stays in place.
+
+        Returns
+        -------
+        artifacts: Artifacts
+            Newly loaded artifacts.
+        """
+        with self._lock:
+            # Take the signature before reading so that a file replaced while
+            # we are loading is picked up again by the next reload check:
+            signature = self._file_signature()
+            model_pth, cat_encoder_pth, label_binarizer_pth = self.paths
+            version = 1 if self._artifacts is None \
+                else self._artifacts.version + 1
+            model = None
+            source_hashes = self._source_hashes()
+            forest, cat_encoder, label_binarizer = \
+                self._load_compact(source_hashes)
+            if forest is None:
+                # Unpickling imports sklearn anyway, joblib is only needed
+                # without an up to date compact export:
+                import joblib
+
+                model = joblib.load(model_pth)
+                cat_encoder = joblib.load(cat_encoder_pth)
+                label_binarizer = joblib.load(label_binarizer_pth)
+                forest = FlatForest.from_sklearn(model)
+            artifacts = Artifacts(
+                model=model,
+                cat_encoder=cat_encoder,
+                label_binarizer=label_binarizer,
+                encoder=FastEncoder.from_encoder(
+                    cat_encoder,
+                    cat_features=u.get_categorical_features(),
+                    num_features=u.get_numerical_features()),
+                forest=forest,
+                lookup=self._load_lookup(source_hashes),
+                version=version)
+            for fn in self._checks:
+                fn(artifacts)
+
+            # A single reference assignment, so readers either see the old
+            # snapshot or the new one, never a mix of both:
+            self._artifacts = artifacts
+            self._signature = signature
+            logging.info(f"Loaded model artifacts version {version} from "
+                         f"{'joblib' if model is not None else 'compact'} "
+                         f"files")
+
+            for fn in self._listeners:
+                fn(artifacts)
+
+        return artifacts
+
+    def reload_if_changed(self):
+        """Reload artifacts if any file changed on disk since the last load
+
+        Artifacts that fail to load (e.g. a file caught mid-copy) are logged
+        and the previous snapshot keeps serving.
+
+        Returns
+        -------
+        reloaded: bool
+            True if a new snapshot was swapped in.
+        """
+        try:
+            if self._file_signature() == self._signature:
+                return False
+            self.load()
+        except Exception:
+            logging.exception("Failed to reload model artifacts")
+            return False
+
+        return True
+
+    def get(self):
+        """Get the current artifacts, loading them on first use
+
+        Returns
+        -------
+        artifacts: Artifacts
+            Current artifacts snapshot.
+        """
+        artifacts = self._artifacts
+        if artifacts is None:
+            artifacts = self.load()
+
+        return artifacts
@@ -0,0 +1,174 @@
+"""Batch scoring pipeline
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import logging
+import joblib
+import numpy as np
+import pandas as pd
+import src.utils as u
+import src.schema as sc
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _validate(chunk, cat_encoder):
+    """Find the rows of a chunk the encoder cannot process
+
+    Numerical columns, read as strings, are parsed in place, so that a bad
+    value only rejects its own row.
+
+    Returns
+    -------
+    errors: pandas series
+        Reasons a row is rejected, empty for valid rows.
+    """
+    errors = pd.Series("", index=chunk.index, dtype=object)
+    for feat, cats in zip(u.get_categorical_features(),
+                          cat_encoder.categories_):
+        invalid = ~chunk[feat].isin(cats)
+        errors[invalid] += f"missing or unknown {feat}; "
+    for feat in u.get_numerical_features():
+        chunk[feat] = pd.to_numeric(chunk[feat], errors="coerce")
+        invalid = chunk[feat].isna()
+        errors[invalid] += f"missing or non-numeric {feat}; "
+
+    return errors.str.rstrip("; ")
+
+
+def _read_and_encode(reader, cat_encoder, label_binarizer):
+    """Read the next chunk of a CSV reader and encode its valid rows
+
+    Returns
+    -------
+    X: numpy array
+        Processed features of the valid rows, None if there are none.
+    errors: pandas series
+        Reasons every row is rejected, empty for valid rows, or None once
+        the reader is exhausted.
+    """
+    try:
+        chunk = next(reader)
+    except StopIteration:
+        return None, None
+
+    errors = _validate(chunk, cat_encoder)
+    valid = (errors == "").values
+    if not valid.any():
+        return None, errors
+
+    X, _, _, _ = u.process_data(
+        df=chunk[valid],
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=cat_encoder,
+        label_binarizer=label_binarizer,
+        sparse=True,
+        dtype=np.float32)
+
+    return X, errors
+
+
+def score_csv(input_pth,
+              output_pth,
+              model_pth,
+              cat_encoder_pth,
+              label_binarizer_pth,
+              chunksize=50000):
+    """Score a CSV file of any size chunk by chunk
+
+    Only one chunk is encoded and one predicted at any time, so memory stays
+    constant however large the input is. The next chunk is read and encoded
+    on a background thread while the current one is predicted. Rows with a
+    missing, unknown or non-numeric feature value are not scored, their
+    prediction is left empty and the reason written to the error column.
+
+    Parameters
+    ----------
+    input_pth: string
+        Path of the CSV to score, with the columns of the clean dataset.
+    output_pth: string
+        Path of the CSV to write, with one prediction and error per input
+        row in the input order.
+    model_pth: string
+        Path of the trained model.
+    cat_encoder_pth: string
+        Path of the pre-trained categorical encoder.
+    label_binarizer_pth: string
+        Path of the pre-trained label binarizer.
+    chunksize: int, default=50000
+        Number of rows read, encoded and predicted at once.
+
+    Returns
+    -------
+    n_rows: int
+        Number of rows scored, rejected rows excluded.
+    """
+    # Load pre-trained estimators:
+    model = joblib.load(model_pth)
+    ohe = joblib.load(cat_encoder_pth)
+    lb = joblib.load(label_binarizer_pth)
+
+    reader = sc.read_csv(
+        input_pth, chunksize=chunksize,
+        dtype={feat: object for feat in u.get_numerical_features()})
+    n_rows = 0
+    n_rejected = 0
+    with ThreadPoolExecutor(max_workers=1) as pool, \
+            open(output_pth, "w", newline="") as f:
+        pending = pool.submit(_read_and_encode, reader, ohe, lb)
+        header = True
+        while True:
+            X, errors = pending.result()
+            if errors is None:
+                break
+
+            # Encode the next chunk while this one is being predicted:
+            pending = pool.submit(_read_and_encode, reader, ohe, lb)
+            labels = np.full(len(errors), "", dtype=object)
+            valid = (errors == "").values
+            if valid.any():
+                labels[valid] = lb.inverse_transform(u.inference(model, X))
+
+            pd.DataFrame({"prediction": labels, "error": errors.values}) \
+                .to_csv(f, header=header, index=False)
+            header = False
+            n_rows += int(valid.sum())
+            n_rejected += int((~valid).sum())
+            logging.info(f"Scored {n_rows} rows")
+
+    if n_rejected:
+        logging.warning(f"Rejected {n_rejected} invalid rows, see the error "
+                        f"column of {output_pth}")
+
+    return n_rows
+
+
+def execute(input_pth, output_pth, chunksize=50000):
+    """Execute batch scoring pipeline
+
+    Parameters
+    ----------
+    input_pth: string
+        Path of the CSV to score.
+    output_pth: string
+        Path of the predictions CSV to write.
+    chunksize: int, default=50000
+        Number of rows scored at once.
+    """
+    # Set up paths:
+    MODEL_PATH = "./model/model.joblib"
+    CAT_ENCODER_PATH = "./model/ohe.joblib"
+    LABEL_BINARIZER_PATH = "./model/lb.joblib"
+
+    # Execute batch scoring pipeline:
+    score_csv(
+        input_pth=input_pth,
+        output_pth=output_pth,
+        model_pth=MODEL_PATH,
+        cat_encoder_pth=CAT_ENCODER_PATH,
+        label_binarizer_pth=LABEL_BINARIZER_PATH,
+        chunksize=chunksize
+    )
@@ -3,20 +3,29 @@
 Author: Dan Sun
 Date: 2022-01-07
 """
+import logging
+import numpy as np
 import pandas as pd
 import src.utils as u
+import src.schema as sc
+import src.data_cache as dc
 import joblib
 
+from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelBinarizer, OneHotEncoder
 
 
-def train_model(df):
+def train_model(df, n_jobs=None):
     """Train model
 
     Parameters
     ----------
     df: pandas dataframe
         Cleaned dataset.
+    n_jobs: int, default=None
+        Number of training workers. If None, use n_jobs of the model
+        parameters.
 
     Returns
     -------
@@ -33,24 +42,169 @@ def train_model(df):
         df=df_train,
         cat_features=u.get_categorical_features(),
         num_features=u.get_numerical_features(),
+        sparse=True,
+        dtype=np.float32,
     )
     cv_scores = ["accuracy", "roc_auc", "f1"]
-    model = u.train_model(X_train, y_train, cv_scores)
+    model = u.train_model(X_train, y_train, cv_scores, n_jobs=n_jobs)
 
     return model, ohe, lb
 
 
-def execute():
+def fit_encoders(chunks, cat_features):
+    """Fit the encoders in one streaming pass over the dataset
+
+    Only the distinct values of every categorical feature and of the label
+    are kept in memory. Encoders are then fitted on a frame holding every
+    distinct value once, so they end up with the categories, in the same
+    sorted order, that fitting on the whole dataset gives.
+
+    Parameters
+    ----------
+    chunks: iterable of pandas dataframe
+        Chunks of the cleaned dataset.
+    cat_features: list of string
+        List of categorical feature names.
+
+    Returns
+    -------
+    cat_encoder: sklearn.preprocessing._encoders.OneHotEncoder
+        Trained OneHotEncoder.
+    label_binarizer: sklearn.preprocessing._label.LabelBinarizer
+        Trained LabelBinarizer.
+    n_rows: int
+        Number of rows of the dataset.
+    """
+    values = {feat: set() for feat in cat_features + [sc.LABEL]}
+    n_rows = 0
+    for chunk in chunks:
+        for feat, seen in values.items():
+            seen.update(chunk[feat].dropna().unique())
+        n_rows += len(chunk)
+
+    # Columns of different lengths are padded with their first value:
+    width = max(len(seen) for seen in values.values())
+    vocab = pd.DataFrame({
+        feat: pd.Series(sorted(values[feat]), dtype=object)
+        .reindex(range(width)).fillna(min(values[feat]))
+        for feat in cat_features})
+    cat_encoder = OneHotEncoder()
+    cat_encoder.fit(vocab)
+    label_binarizer = LabelBinarizer()
+    label_binarizer.fit(np.array(sorted(values[sc.LABEL]), dtype=object))
+
+    return cat_encoder, label_binarizer, n_rows
+
+
+def train_model_out_of_core(read_chunks, n_jobs=None):
+    """Train model on a dataset streamed in chunks
+
+    The encoders are fitted in a first pass. The forest then grows with
+    warm_start in a second pass: every chunk fits its share of the trees
+    on its own rows, so only one chunk is ever encoded and densified.
+    Chunks too small to be due a tree, or missing a class, are carried
+    over with their trees to the next chunk, so every row is used.
+    As in `train_model`, 20% of every chunk is held out. Cross validation
+    needs the whole dataset in memory and is skipped, the inference stage
+    still scores the model.
+
+    Parameters
+    ----------
+    read_chunks: callable
+        Function returning a new iterator over chunks of the cleaned
+        dataset, called once per pass.
+    n_jobs: int, default=None
+        Number of training workers. If None, use n_jobs of the model
+        parameters.
+
+    Returns
+    -------
+    model: sklearn.ensemble._forest.RandomForestClassifier
+        Trained machine learning model.
+    cat_encoder: sklearn.preprocessing._encoders.OneHotEncoder
+        Trained OneHotEncoder.
+    label_binarizer: sklearn.preprocessing._label.LabelBinarizer
+        Trained LabelBinarizer.
+    """
+    cat_features = u.get_categorical_features()
+    cat_encoder, label_binarizer, n_rows = fit_encoders(
+        read_chunks(), cat_features)
+
+    params = u._get_model_params()
+    if n_jobs is not None:
+        params["n_jobs"] = n_jobs
+    n_estimators = params.pop("n_estimators")
+    model = RandomForestClassifier(n_estimators=0, warm_start=True, **params)
+
+    n_rows_seen = 0
+    pending = []
+    for chunk in read_chunks():
+        df_train, _ = train_test_split(chunk, test_size=0.20)
+        pending.append(df_train)
+
+        # Trees are shared out in proportion to rows, rounding down, so the
+        # forest reaches n_estimators with the last chunk only. Rows of a
+        # chunk not due any tree yet are fitted with the next chunk:
+        n_rows_seen += len(chunk)
+        n_trees = n_estimators * n_rows_seen // n_rows
+        if n_trees <= model.n_estimators:
+            continue
+
+        X_train, y_train, _, _ = u.process_data(
+            df=pd.concat(pending) if len(pending) > 1 else pending[0],
+            cat_features=cat_features,
+            num_features=u.get_numerical_features(),
+            training=False,
+            cat_encoder=cat_encoder,
+            label_binarizer=label_binarizer,
+            sparse=True,
+            dtype=np.float32,
+        )
+        # Every tree must see every class, or their outputs do not line up:
+        if len(np.unique(y_train)) < len(label_binarizer.classes_):
+            logging.warning(f"Rows up to row {n_rows_seen} miss a class, "
+                            f"they move to the next chunk with their trees")
+            continue
+
+        model.set_params(n_estimators=n_trees)
+        model.fit(X_train, y_train)
+        pending = []
+        logging.info(f"Fitted {n_trees} of {n_estimators} trees on "
+                     f"{n_rows_seen} of {n_rows} rows")
+
+    if pending:
+        raise ValueError("The last chunks miss a class, use a larger "
+                         "chunksize")
+
+    return model, cat_encoder, label_binarizer
+
+
+def execute(n_jobs=None, chunksize=None):
     """Execute model training pipeline
+
+    Parameters
+    ----------
+    n_jobs: int, default=None
+        Number of training workers. If None, use n_jobs of the model
+        parameters.
+    chunksize: int, default=None
+        If set, train out of core on chunks of chunksize rows streamed from
+        the clean CSV, for datasets larger than memory.
     """
     # Set up paths:
     CLEAN_DATA_PATH = "./data/clean_data/clean_census.csv"
-
-    # Load clean data:
-    CLEAN_DATA = pd.read_csv(CLEAN_DATA_PATH, skipinitialspace=True)
+    CLEAN_DATA_CACHE_PATH = "./data/clean_data/clean_census_cache"
 
     # Execute model training pipeline:
-    model, ohe, lb = train_model(CLEAN_DATA)
+    if chunksize is not None:
+        model, ohe, lb = train_model_out_of_core(
+            lambda: sc.read_csv(CLEAN_DATA_PATH, chunksize=chunksize),
+            n_jobs=n_jobs)
+    else:
+        # Load clean data:
+        CLEAN_DATA = dc.read_clean_data(
+            CLEAN_DATA_PATH, CLEAN_DATA_CACHE_PATH)
+        model, ohe, lb = train_model(CLEAN_DATA, n_jobs=n_jobs)
 
     # Save estimator and encoders:
     joblib.dump(model, "./model/model.joblib")
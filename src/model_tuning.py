@@ -0,0 +1,162 @@
+"""Hyperparameter tuning pipeline
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import json
+import logging
+import numpy as np
+import src.utils as u
+import src.data_cache as dc
+
+from sklearn.ensemble import RandomForestClassifier
+# Successive halving is still experimental in sklearn and must be enabled
+# before it can be imported:
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import (HalvingRandomSearchCV,
+                                     StratifiedKFold, train_test_split)
+
+
+def _get_param_distributions():
+    """Set the hyperparameter search space
+
+    Returns
+    -------
+    param_distributions: dictionary
+        Candidate values of every tuned model parameter.
+    """
+    param_distributions = {
+        "n_estimators": [50, 100, 200, 400],
+        "max_depth": [3, 5, 8, 12, 16, None],
+        "min_samples_leaf": [1, 2, 5, 10, 20],
+        "max_features": ["sqrt", 0.2, 0.4],
+        "criterion": ["gini", "entropy"],
+    }
+
+    return param_distributions
+
+
+def tune_model(df,
+               n_candidates=64,
+               factor=3,
+               scoring="roc_auc",
+               n_jobs=-1,
+               param_distributions=None):
+    """Search model parameters with successive halving over training rows
+
+    All candidates are first cross validated on a small sample of rows. Only
+    the best 1/factor of them survive to the next round, which gets factor
+    times more rows, until the survivors are evaluated on the full training
+    set. Bad configurations are thus stopped early, on cheap subsets.
+
+    Parameters
+    ----------
+    df: pandas dataframe
+        Cleaned dataset.
+    n_candidates: int, default=64
+        Number of parameter combinations sampled for the first round.
+    factor: int, default=3
+        Proportion of candidates eliminated and growth of rows every round.
+    scoring: string, default="roc_auc"
+        Score ranking the candidates.
+    n_jobs: int, default=-1
+        Number of processes evaluating candidates and folds, every forest
+        is single-threaded.
+    param_distributions: dictionary, default=None
+        Search space. If None, use `_get_param_distributions`.
+
+    Returns
+    -------
+    best_params: dictionary
+        Model parameters of the winning candidate.
+    best_score: float
+        Cross validated score of the winning candidate.
+    """
+    if param_distributions is None:
+        param_distributions = _get_param_distributions()
+
+    df_train, _ = train_test_split(df, test_size=0.20)
+    X_train, y_train, _, _ = u.process_data(
+        df=df_train,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        sparse=True,
+        dtype=np.float32,
+    )
+
+    # Start from the current parameters, so that anything not tuned keeps
+    # its value, and parallelize over candidates and folds only:
+    base_params = u._get_model_params()
+    base_params["n_jobs"] = 1
+    search = HalvingRandomSearchCV(
+        RandomForestClassifier(**base_params),
+        param_distributions=param_distributions,
+        n_candidates=n_candidates,
+        factor=factor,
+        resource="n_samples",
+        # Start small enough that the last round uses every training row:
+        min_resources="exhaust",
+        # Keep both classes in every fold of the small first rounds:
+        cv=StratifiedKFold(n_splits=5, shuffle=True, random_state=42),
+        scoring=scoring,
+        n_jobs=n_jobs,
+        random_state=42)
+    search.fit(X_train, y_train)
+
+    for i, (n, r) in enumerate(zip(search.n_candidates_,
+                                   search.n_resources_)):
+        logging.info(f"Round {i}: {n} candidates on {r} rows")
+    logging.info(f"Best {scoring}: {search.best_score_:.4f} with "
+                 f"{search.best_params_}")
+
+    return search.best_params_, search.best_score_
+
+
+def save_params(params, score, scoring, params_pth):
+    """Save tuned parameters where `u._get_model_params` reads them
+
+    Parameters
+    ----------
+    params: dictionary
+        Tuned model parameters.
+    score: float
+        Cross validated score of the parameters.
+    scoring: string
+        Name of the score.
+    params_pth: string
+        Path of the JSON file to write.
+    """
+    with open(params_pth, "w") as f:
+        json.dump({"params": params, "scoring": scoring, "score": score},
+                  f, indent=2)
+
+
+def execute(n_candidates=64, n_jobs=-1):
+    """Execute hyperparameter tuning pipeline
+
+    Parameters
+    ----------
+    n_candidates: int, default=64
+        Number of parameter combinations sampled for the first round.
+    n_jobs: int, default=-1
+        Number of processes evaluating candidates.
+    """
+    # Set up paths:
+    CLEAN_DATA_PATH = "./data/clean_data/clean_census.csv"
+    CLEAN_DATA_CACHE_PATH = "./data/clean_data/clean_census_cache"
+
+    # Load clean data:
+    CLEAN_DATA = dc.read_clean_data(
+        CLEAN_DATA_PATH, CLEAN_DATA_CACHE_PATH)
+
+    # Execute hyperparameter tuning pipeline:
+    scoring = "roc_auc"
+    params, score = tune_model(CLEAN_DATA, n_candidates=n_candidates,
+                               scoring=scoring, n_jobs=n_jobs)
+
+    # Save winning parameters for training:
+    save_params(params, score, scoring, u.MODEL_PARAMS_PATH)
+
+
+if __name__ == "__main__":
+    execute()
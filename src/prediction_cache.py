@@ -0,0 +1,116 @@
+"""Bounded LRU/TTL cache of predictions
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """Least recently used cache whose entries also expire after a TTL
+
+    Parameters
+    ----------
+    max_size: int
+        Largest number of entries kept, 0 disables the cache.
+    ttl: float
+        Seconds an entry stays valid, 0 means entries never expire.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @staticmethod
+    def make_key(record, version):
+        """Build the canonical key of a validated record
+
+        Parameters
+        ----------
+        record: pydantic.BaseModel
+            Validated record, its fields are taken in declaration order.
+        version: int
+            Version of the artifacts the prediction is made with, so that
+            predictions of a previous model can never be served.
+
+        Returns
+        -------
+        key: tuple
+            Hashable key.
+        """
+        return (version,) + tuple(v for _, v in record)
+
+    def get(self, key):
+        """Get a cached prediction
+
+        Returns
+        -------
+        value: object
+            Cached prediction, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            value, expires_at = entry
+            if self.ttl > 0 and time.monotonic() > expires_at:
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+
+            return value
+
+    def put(self, key, value):
+        """Cache a prediction, evicting the least recently used if full
+        """
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        """Drop every entry, e.g. once new model artifacts are loaded
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Get cache usage counters
+
+        Returns
+        -------
+        stats: dictionary
+            Size, bounds, and hit, miss, eviction and expiration counters.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
@@ -0,0 +1,101 @@
+"""Bounded executor running CPU bound predictions off the event loop
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Raised when a request cannot be queued without unbounded latency
+    """
+
+
+class BoundedExecutor:
+    """Run blocking functions on a thread pool with a bounded backlog
+
+    A thread pool keeps the event loop free without copying the model into
+    other processes. Only the numpy and sklearn parts of a prediction, such
+    as the tree traversal, release the GIL and run in parallel; pure Python
+    steps like the per record loop of FastEncoder still hold it, so jobs
+    interleave rather than truly overlap there.
+
+    Jobs beyond the pool size wait in a queue of at most max_queue_size
+    entries; any further job is rejected right away with QueueFullError
+    instead of letting latency grow without bound.
+
+    Parameters
+    ----------
+    max_workers: int
+        Number of prediction threads.
+    max_queue_size: int
+        Largest number of jobs waiting for a free thread.
+    """
+
+    def __init__(self, max_workers, max_queue_size):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._executor = None
+        self._pending = 0
+        self._rejected = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the pool and wait for its result
+
+        Parameters
+        ----------
+        fn: callable
+            Blocking function to run.
+        *args: object
+            Arguments of fn.
+
+        Returns
+        -------
+        result: object
+            Return value of fn.
+        """
+        # Only ever touched from the event loop thread, so no lock needed:
+        if self._pending >= self.max_workers + self.max_queue_size:
+            self._rejected += 1
+            raise QueueFullError(
+                f"Prediction queue is full ({self._pending} jobs pending)")
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="predict")
+
+        self._pending += 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executor, functools.partial(fn, *args))
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        """Wait for running jobs and release the threads
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self):
+        """Get pool usage statistics
+
+        Returns
+        -------
+        stats: dictionary
+            Pool size, queue bound, pending jobs and rejected jobs.
+        """
+        return {
+            "pool_size": self.max_workers,
+            "max_queue_size": self.max_queue_size,
+            "pending": self._pending,
+            "rejected": self._rejected,
+        }
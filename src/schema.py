@@ -0,0 +1,118 @@
+"""Schema of the census dataset
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import pandas as pd
+import src.utils as u
+
+# Literal types let you indicate that an expression is equal to some specific
+# primitive value. For example, if we annotate a variable with type
+# Literal["foo"], this .py script will understand that variable is not only of
+# type str, but is also equal to specifically the string "foo".
+from typing import Literal, get_args
+
+
+# Declare the allowed values of every categorical feature once, so they can
+# be shared by the API data objects and the dataset schema.
+Workclass = Literal[
+    'State-gov', 'Self-emp-not-inc', 'Private', 'Federal-gov',
+    'Local-gov', 'Self-emp-inc', 'Without-pay']
+Education = Literal[
+    'Bachelors', 'HS-grad', '11th', 'Masters', '9th', 'Some-college',
+    'Assoc-acdm', '7th-8th', 'Doctorate', 'Assoc-voc', 'Prof-school',
+    '5th-6th', '10th', 'Preschool', '12th', '1st-4th']
+MaritalStatus = Literal[
+    'Never-married', 'Married-civ-spouse', 'Divorced',
+    'Married-spouse-absent', 'Separated', 'Married-AF-spouse', 'Widowed']
+Occupation = Literal[
+    'Adm-clerical', 'Exec-managerial', 'Handlers-cleaners',
+    'Prof-specialty', 'Other-service', 'Sales', 'Transport-moving',
+    'Farming-fishing', 'Machine-op-inspct', 'Tech-support',
+    'Craft-repair', 'Protective-serv', 'Armed-Forces', 'Priv-house-serv']
+Relationship = Literal[
+    'Not-in-family', 'Husband', 'Wife', 'Own-child', 'Unmarried',
+    'Other-relative']
+Race = Literal[
+    'White', 'Black', 'Asian-Pac-Islander', 'Amer-Indian-Eskimo', 'Other']
+Sex = Literal['Male', 'Female']
+NativeCountry = Literal[
+    'United-States', 'Cuba', 'Jamaica', 'India', 'Mexico', 'Puerto-Rico',
+    'Honduras', 'England', 'Canada', 'Germany', 'Iran', 'Philippines',
+    'Poland', 'Columbia', 'Cambodia', 'Thailand', 'Ecuador', 'Laos',
+    'Taiwan', 'Haiti', 'Portugal', 'Dominican-Republic', 'El-Salvador',
+    'France', 'Guatemala', 'Italy', 'China', 'South', 'Japan',
+    'Yugoslavia', 'Peru', 'Outlying-US(Guam-USVI-etc)', 'Scotland',
+    'Trinadad&Tobago', 'Greece', 'Nicaragua', 'Vietnam', 'Hong', 'Ireland',
+    'Hungary', 'Holand-Netherlands']
+
+# Literal of every categorical feature, in the order of
+# `u.get_categorical_features`:
+FEATURE_LITERALS = dict(zip(
+    u.get_categorical_features(),
+    [Workclass, Education, MaritalStatus, Occupation, Relationship, Race,
+     Sex, NativeCountry]))
+
+# Columns of the raw dataset which are not model features:
+LABEL = "salary"
+EXTRA_NUMERICAL_COLUMNS = ["fnlgt", "capital-gain", "capital-loss"]
+
+# Missing values are written "?" in the census files:
+NA_VALUES = "?"
+
+
+def get_categories():
+    """Get the values a User may take for every categorical feature
+
+    Returns
+    -------
+    categories: dictionary
+        Allowed values keyed by categorical feature name.
+    """
+    categories = {feat: list(get_args(literal))
+                  for feat, literal in FEATURE_LITERALS.items()}
+
+    return categories
+
+
+def get_dtypes():
+    """Get the dtype of every column of the census files
+
+    Categorical features and the label are parsed as pandas categoricals,
+    which store every distinct string once plus one small integer code per
+    row, instead of one Python string object per row. Their categories are
+    inferred rather than fixed to `get_categories`, so that a value missing
+    from the User data object is kept rather than silently turned into NaN.
+
+    Returns
+    -------
+    dtypes: dictionary
+        Dtype keyed by column name.
+    """
+    dtypes = {feat: "category" for feat in FEATURE_LITERALS}
+    dtypes[LABEL] = "category"
+    for feat in u.get_numerical_features() + EXTRA_NUMERICAL_COLUMNS:
+        dtypes[feat] = "int64"
+
+    return dtypes
+
+
+def read_csv(pth, **kwargs):
+    """Read a census file with the schema dtypes
+
+    Parameters
+    ----------
+    pth: string
+        Path of the raw or clean CSV.
+    **kwargs:
+        Other arguments of `pandas.read_csv`, e.g. chunksize. A dtype
+        dictionary overrides the schema dtypes of its columns only.
+
+    Returns
+    -------
+    df: pandas dataframe or TextFileReader
+        Parsed dataset, with "?" parsed as missing.
+    """
+    dtype = {**get_dtypes(), **kwargs.pop("dtype", {})}
+    return pd.read_csv(pth, skipinitialspace=True, na_values=NA_VALUES,
+                       dtype=dtype, **kwargs)
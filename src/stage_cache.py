@@ -0,0 +1,126 @@
+"""Fingerprints of pipeline stages, to skip the ones already up to date
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import json
+import hashlib
+import logging
+
+from src.data_cache import file_hash
+
+
+class StageCache:
+    """Record of the fingerprint every pipeline stage last ran with
+
+    A stage fingerprint hashes the content of its input files, of the source
+    files of its code, and its parameters. If a stage is asked to run with
+    the fingerprint of its last run, and its outputs are still the files it
+    wrote then, it is skipped and its outputs reused.
+
+    Parameters
+    ----------
+    pth: string
+        JSON file of the records, created on the first recorded run.
+    """
+
+    def __init__(self, pth):
+        self.pth = pth
+        self._stages = {}
+        if os.path.exists(pth):
+            with open(pth) as f:
+                self._stages = json.load(f)
+
+    @staticmethod
+    def fingerprint(inputs, code, params=None):
+        """Hash everything a stage output depends on
+
+        Parameters
+        ----------
+        inputs: list of string
+            Paths of the input files.
+        code: list of string
+            Paths of the source files of the stage.
+        params: dictionary, default=None
+            JSON serializable parameters of the stage.
+
+        Returns
+        -------
+        fingerprint: string
+            Hexadecimal SHA-256 of the stage dependencies.
+        """
+        deps = {
+            "inputs": {pth: file_hash(pth) for pth in inputs},
+            "code": {pth: file_hash(pth) for pth in code},
+            "params": params or {},
+        }
+        blob = json.dumps(deps, sort_keys=True, default=str).encode()
+
+        return hashlib.sha256(blob).hexdigest()
+
+    def is_fresh(self, name, fingerprint, outputs):
+        """Check if a stage already ran with this fingerprint
+
+        Returns
+        -------
+        fresh: bool
+            True if the last run of the stage had this fingerprint and all
+            of its outputs are unchanged since.
+        """
+        record = self._stages.get(name)
+        if record is None or record["fingerprint"] != fingerprint:
+            return False
+        if sorted(record["outputs"]) != sorted(outputs):
+            return False
+
+        return all(os.path.exists(pth) and file_hash(pth) == digest
+                   for pth, digest in record["outputs"].items())
+
+    def record(self, name, fingerprint, outputs):
+        """Record a successful run of a stage and save the records
+        """
+        self._stages[name] = {
+            "fingerprint": fingerprint,
+            "outputs": {pth: file_hash(pth) for pth in outputs},
+        }
+        tmp_pth = f"{self.pth}.tmp"
+        with open(tmp_pth, "w") as f:
+            json.dump(self._stages, f, indent=2, sort_keys=True)
+        os.replace(tmp_pth, self.pth)
+
+    def run(self, name, fn, inputs, outputs, code, params=None,
+            force=False):
+        """Run a stage unless it is up to date
+
+        Parameters
+        ----------
+        name: string
+            Name of the stage.
+        fn: callable
+            Function running the stage, without arguments.
+        inputs: list of string
+            Paths of the files the stage reads.
+        outputs: list of string
+            Paths of the files the stage writes.
+        code: list of string
+            Paths of the source files of the stage.
+        params: dictionary, default=None
+            Parameters changing the stage outputs.
+        force: bool, default=False
+            If True, run the stage even if it is up to date.
+
+        Returns
+        -------
+        ran: bool
+            False if the stage was skipped.
+        """
+        fingerprint = self.fingerprint(inputs, code, params)
+        if not force and self.is_fresh(name, fingerprint, outputs):
+            logging.info(f"Stage {name} is up to date, reusing {outputs}")
+            return False
+
+        fn()
+        self.record(name, fingerprint, outputs)
+
+        return True
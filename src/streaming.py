@@ -0,0 +1,61 @@
+"""Helpers to stream newline delimited JSON in and out of a route
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+from starlette.responses import StreamingResponse
+
+
+class LineTooLongError(ValueError):
+    """Raised when a line exceeds the maximum accepted length
+    """
+
+
+async def iter_lines(stream, max_line_bytes):
+    """Split a stream of byte chunks into lines as they arrive
+
+    Only the current partial line is buffered, so memory is bounded by
+    max_line_bytes plus the size of one chunk, however long the stream.
+
+    Parameters
+    ----------
+    stream: async iterable of bytes
+        Body chunks, e.g. `request.stream()`.
+    max_line_bytes: int
+        Longest line accepted.
+
+    Yields
+    ------
+    line: bytes
+        Every line, without its newline.
+    """
+    buffer = b""
+    async for data in stream:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if len(line) > max_line_bytes:
+                raise LineTooLongError(
+                    f"Line longer than {max_line_bytes} bytes")
+            yield line
+        if len(buffer) > max_line_bytes:
+            raise LineTooLongError(f"Line longer than {max_line_bytes} bytes")
+    if buffer:
+        yield buffer
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """Streaming response whose body is produced while the request is read
+
+    StreamingResponse listens for the client disconnect while streaming,
+    which consumes the request body messages a body iterator reading
+    `request.stream()` needs. Here the body iterator reads them itself, and
+    gets a ClientDisconnect if the client goes away.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -3,13 +3,20 @@
 Author: Dan Sun
 Date: 2022-01-07
 """
+import os
+import json
 import logging
 import numpy as np
+import pandas as pd
 
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import OneHotEncoder, LabelBinarizer
-from sklearn.model_selection import KFold, cross_val_score
-from sklearn.metrics import accuracy_score, precision_score, recall_score
+# sklearn and scipy are only imported by the functions that fit, score or
+# build sparse matrices, so that serving, which imports this module too,
+# does not pay for them at startup.
+
+
+# Parameters found by `python main.py --action tune`, overriding the defaults
+# of _get_model_params when present:
+MODEL_PARAMS_PATH = "./model/model_params.json"
 
 
 def get_categorical_features():
@@ -51,9 +58,15 @@ def get_numerical_features():
     return num_feats
 
 
-def _get_model_params():
+def _get_model_params(params_pth=MODEL_PARAMS_PATH):
     """Set model parameters
 
+    Parameters
+    ----------
+    params_pth: string, default=MODEL_PARAMS_PATH
+        JSON file of tuned parameters overriding the defaults, ignored if it
+        does not exist.
+
     Returns
     -------
     params: dictionary
@@ -67,6 +80,10 @@ def _get_model_params():
         "n_jobs": -1
     }
 
+    if os.path.exists(params_pth):
+        with open(params_pth) as f:
+            params.update(json.load(f)["params"])
+
     return params
 
 
@@ -75,7 +92,9 @@ def process_data(df,
                  num_features,
                  training=True,
                  cat_encoder=None,
-                 label_binarizer=None):
+                 label_binarizer=None,
+                 sparse=False,
+                 dtype=None):
     """Process data for later train test split
 
     Parameters
@@ -95,10 +114,18 @@ def process_data(df,
         Trained sklearn label binarizer. If the label/target is not integer,
         then use LabelBinarizer to convert string to integer. Only used if
         training=False.
+    sparse: bool, default=False
+        If True, return the features as a scipy CSR matrix instead of a dense
+        numpy array. Only the non-zero one hot cells are then stored, which
+        is roughly 10x less memory than the dense matrix.
+    dtype: numpy dtype, default=None
+        Dtype of the returned features, numerical ones included, e.g.
+        np.float32, which the random forest converts to anyway. If None,
+        float64 for numeric features.
 
     Returns
     -------
-    X: numpy array
+    X: numpy array or scipy.sparse.csr_matrix
         Processed features.
     y: numpy array
         Processed label
@@ -108,6 +135,12 @@ def process_data(df,
     label_binarizer: sklearn.preprocessing._label.LabelBinarizer
         Trained LabelBinarizer if training is True, otherwise returns default
         binarizer.
+
+    Raises
+    ------
+    ValueError
+        If the numerical features do not fit in dtype, e.g. negative or
+        above 255 values for np.uint8, which a cast would silently wrap.
     """
     # Asign X and y:
     feats = cat_features + num_features
@@ -118,6 +151,8 @@ def process_data(df,
     X_cat = X[cat_features]
     X_num = X[num_features]
     if (training):
+        from sklearn.preprocessing import OneHotEncoder, LabelBinarizer
+
         cat_encoder = OneHotEncoder()
         label_binarizer = LabelBinarizer()
         X_cat = cat_encoder.fit_transform(X_cat)
@@ -130,46 +165,96 @@ def process_data(df,
         except ValueError:
             pass
 
+    if dtype is not None:
+        _check_dtype_range(X_num.values, dtype)
+
     # Concatenate numerical and categorical features:
     # Since we have many categorical features, X_cat will be a sparse matrix
     # which is not a subclasses of numpy arrays. Thus, numpy methods often do
-    # not work. To address this, make the sparse matrix dense first using
-    # `.toarray()`, then use np.concatenate().
-    X_cat = X_cat.toarray()
-    X = np.concatenate([X_cat, X_num], axis=1)
+    # not work. To address this, either stack it with the numerical features
+    # using scipy, or make the sparse matrix dense first using `.toarray()`,
+    # then use np.concatenate().
+    if (sparse):
+        import scipy.sparse
+
+        X = scipy.sparse.hstack([X_cat, X_num.values], format="csr",
+                                dtype=dtype)
+    else:
+        X_cat = X_cat.toarray()
+        X = np.concatenate([X_cat, X_num], axis=1)
+        if dtype is not None:
+            X = X.astype(dtype, copy=False)
 
     return X, y, cat_encoder, label_binarizer
 
 
-def train_model(X_train, y_train, cv_scores):
+def _check_dtype_range(values, dtype):
+    """Raise a ValueError unless values can be cast to dtype without wrapping
+    """
+    dtype = np.dtype(dtype)
+    values = values[~np.isnan(values)] if dtype.kind == "f" else values
+    if values.size == 0:
+        return
+
+    if dtype.kind in "iu":
+        info = np.iinfo(dtype)
+        fits = np.all(np.mod(values, 1) == 0)
+    else:
+        info = np.finfo(dtype)
+        fits = True
+    if not (fits and info.min <= values.min() and values.max() <= info.max):
+        raise ValueError(
+            f"Numerical features range from {values.min()} to "
+            f"{values.max()}, which do not fit in {dtype}")
+
+
+def train_model(X_train, y_train, cv_scores, n_jobs=None):
     """Train a machine learning model and calculate cv scores
 
+    All scores are computed from a single cross validation run, so every
+    fold is fitted once. Folds run in parallel with single-threaded forests
+    to avoid nesting a parallel forest inside parallel folds.
+
     Parameters
     ----------
-    X_train: numpy array
+    X_train: numpy array or scipy.sparse.csr_matrix
         Training feature data.
     y_train: numpy array
         Training label data.
     cv_scores: list of string
         Name of scores to calculate.
+    n_jobs: int, default=None
+        Number of workers fitting the final forest and, separately, the
+        folds. If None, use n_jobs of the model parameters.
 
     Returns
     -------
     model: sklearn.ensemble._forest.RandomForestClassifier
         Trained machine learning model.
     """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.base import clone
+    from sklearn.model_selection import KFold, cross_validate
+
     # Fit training data to model estimator:
     _params = _get_model_params()
+    if n_jobs is not None:
+        _params["n_jobs"] = n_jobs
     model = RandomForestClassifier(**_params)
     model.fit(X_train, y_train)
 
     # Calculate cross validated performance scores:
     cv = KFold(n_splits=10, shuffle=True, random_state=42)
+    cv_results = cross_validate(
+        clone(model).set_params(n_jobs=1), X_train, y_train,
+        scoring=cv_scores, cv=cv, n_jobs=_params["n_jobs"])
     for s in cv_scores:
-        cv_score = cross_val_score(model, X_train, y_train, scoring=s,
-                                   cv=cv, n_jobs=-1)
-        _cv_scores = list(map(lambda x: round(x, 2), cv_score))
+        _cv_scores = list(map(lambda x: round(x, 2), cv_results[f"test_{s}"]))
         logging.info(f"{s}: {_cv_scores}")
+    _fit_times = list(map(lambda x: round(x, 2), cv_results["fit_time"]))
+    _score_times = list(map(lambda x: round(x, 2), cv_results["score_time"]))
+    logging.info(f"fit time per fold (s): {_fit_times}")
+    logging.info(f"score time per fold (s): {_score_times}")
 
     return model
 
@@ -184,6 +269,8 @@ def calculate_metrics(y_true, y_pred):
     y_pred: numpy array
         Predicted label values.
     """
+    from sklearn.metrics import accuracy_score, precision_score, recall_score
+
     acc = accuracy_score(y_true, y_pred)
     recall = recall_score(y_true, y_pred, zero_division=1)
     precision = precision_score(y_true, y_pred, zero_division=1)
@@ -191,6 +278,58 @@ def calculate_metrics(y_true, y_pred):
     return acc, recall, precision
 
 
+def calculate_slice_metrics(df, y_true, y_pred, cat_features):
+    """Calculate model metrics on every slice of categorical features
+
+    Confusion counts are aggregated per category with one groupby per
+    feature, instead of filtering, encoding and predicting every slice
+    separately. Metrics follow `calculate_metrics`, including a score of 1
+    when recall or precision have a zero denominator.
+
+    Parameters
+    ----------
+    df: pandas dataframe
+        Dataset the predictions were made on.
+    y_true: numpy array
+        Binarized true labels, in the row order of df.
+    y_pred: numpy array
+        Predicted label values, in the row order of df.
+    cat_features: list of string
+        List of categorical feature names to slice on.
+
+    Returns
+    -------
+    slice_metrics: pandas dataframe
+        One row per (feature, category), in order of first appearance, with
+        row count, confusion counts, accuracy, recall and precision.
+    """
+    y_true = np.asarray(y_true).astype(bool)
+    y_pred = np.asarray(y_pred).astype(bool)
+    counts = pd.DataFrame({
+        "tp": y_true & y_pred,
+        "fp": ~y_true & y_pred,
+        "fn": y_true & ~y_pred,
+        "tn": ~y_true & ~y_pred,
+    }).astype(np.int64)
+
+    slices = []
+    for cat_feat in cat_features:
+        grouped = counts.groupby(
+            df[cat_feat].values, sort=False, observed=True).sum()
+        grouped.insert(0, "category", grouped.index.astype(str))
+        grouped.insert(0, "feature", cat_feat)
+        slices.append(grouped.reset_index(drop=True))
+    slice_metrics = pd.concat(slices, ignore_index=True)
+
+    tp, fp, fn, tn = (slice_metrics[c] for c in ["tp", "fp", "fn", "tn"])
+    slice_metrics["n"] = tp + fp + fn + tn
+    slice_metrics["accuracy"] = (tp + tn) / slice_metrics["n"]
+    slice_metrics["recall"] = (tp / (tp + fn)).where(tp + fn > 0, 1.0)
+    slice_metrics["precision"] = (tp / (tp + fp)).where(tp + fp > 0, 1.0)
+
+    return slice_metrics
+
+
 def inference(model, X):
     """Run model inference and predict on new data
 
@@ -198,8 +337,9 @@ def inference(model, X):
     ----------
     model: sklearn.ensemble._forest.RandomForestClassifier
         Trained machine learning model
-    X: pandas dataframe
-        New dataset used to generate the prediction
+    X: numpy array or scipy.sparse.csr_matrix
+        Processed features of the new dataset used to generate the
+        prediction
 
     Returns
     -------
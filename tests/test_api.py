@@ -3,6 +3,15 @@
 Author: Dan Sun
 Date: 2022-01-07
 """
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import subprocess
+import urllib.error
+import urllib.request
 import pytest
 import src.api as api
 
@@ -11,10 +20,10 @@ from fastapi.testclient import TestClient
 
 @pytest.fixture
 def client():
-    """Get user data
+    """Get API client with startup and shutdown events triggered
     """
-    api_client = TestClient(api.app)
-    return api_client
+    with TestClient(api.app) as api_client:
+        yield api_client
 
 
 def test_get_home_message(client):
@@ -76,3 +85,387 @@ def test_post_malformed(client):
         "education_num": 9,
         "hours_per_week": 33})
     assert r.status_code == 422
+
+
+def test_post_batch(client):
+    r = client.post("/batch", json=[
+        {
+            "workclass": "State-gov",
+            "education": "Doctorate",
+            "marital_status": "Married-civ-spouse",
+            "occupation": "Prof-specialty",
+            "relationship": "Wife",
+            "race": "White",
+            "sex": "Female",
+            "native_country": "United-States",
+            "age": 48,
+            "education_num": 16,
+            "hours_per_week": 46},
+        {
+            "workclass": "Private",
+            "education": "HS-grad",
+            "marital_status": "Divorced",
+            "occupation": "Craft-repair",
+            "relationship": "Not-in-family",
+            "race": "White",
+            "sex": "Male",
+            "native_country": "United-States",
+            "age": 34,
+            "education_num": 9,
+            "hours_per_week": 40}])
+    assert r.status_code == 200
+    assert r.json() == {"predictions": [">50K", "<=50K"]}
+
+
+def test_post_batch_columnar(client):
+    r = client.post("/batch", json={
+        "workclass": ["Private", "State-gov"],
+        "education": ["HS-grad", "Doctorate"],
+        "marital_status": ["Divorced", "Married-civ-spouse"],
+        "occupation": ["Craft-repair", "Prof-specialty"],
+        "relationship": ["Not-in-family", "Wife"],
+        "race": ["White", "White"],
+        "sex": ["Male", "Female"],
+        "native_country": ["United-States", "United-States"],
+        "age": [34, 48],
+        "education_num": [9, 16],
+        "hours_per_week": [40, 46]})
+    assert r.status_code == 200
+    assert r.json() == {"predictions": ["<=50K", ">50K"]}
+
+
+def test_post_batch_columnar_malformed(client):
+    r = client.post("/batch", json={
+        "workclass": ["Private", "State-gov"],
+        "education": ["HS-grad", "Doctorate"],
+        "marital_status": ["Divorced", "Married-civ-spouse"],
+        "occupation": ["Craft-repair", "Prof-specialty"],
+        "relationship": ["Not-in-family", "Wife"],
+        "race": ["White", "White"],
+        "sex": ["Male", "Female"],
+        "native_country": ["United-States", "United-States"],
+        "age": [34],
+        "education_num": [9, 16],
+        "hours_per_week": [40, 46]})
+    assert r.status_code == 422
+
+
+def test_post_batch_too_large(client, monkeypatch):
+    monkeypatch.setattr(api, "MAX_BATCH_SIZE", 1)
+    r = client.post("/batch", json={
+        "workclass": ["Private", "State-gov"],
+        "education": ["HS-grad", "Doctorate"],
+        "marital_status": ["Divorced", "Married-civ-spouse"],
+        "occupation": ["Craft-repair", "Prof-specialty"],
+        "relationship": ["Not-in-family", "Wife"],
+        "race": ["White", "White"],
+        "sex": ["Male", "Female"],
+        "native_country": ["United-States", "United-States"],
+        "age": [34, 48],
+        "education_num": [9, 16],
+        "hours_per_week": [40, 46]})
+    assert r.status_code == 413
+
+
+def test_get_stats(client):
+    client.post("/", json={
+        "workclass": "Private",
+        "education": "HS-grad",
+        "marital_status": "Divorced",
+        "occupation": "Craft-repair",
+        "relationship": "Not-in-family",
+        "race": "White",
+        "sex": "Male",
+        "native_country": "United-States",
+        "age": 34,
+        "education_num": 9,
+        "hours_per_week": 40})
+    r = client.get("/stats")
+    assert r.status_code == 200
+    assert sum(r.json()["micro_batching"]["batch_size_histogram"].values()) > 0
+
+
+def test_post_batch_overloaded(client, monkeypatch):
+    monkeypatch.setattr(api.executor, "max_queue_size", 0)
+    monkeypatch.setattr(api.executor, "max_workers", 0)
+    r = client.post("/batch", json=[{
+        "workclass": "Private",
+        "education": "HS-grad",
+        "marital_status": "Divorced",
+        "occupation": "Craft-repair",
+        "relationship": "Not-in-family",
+        "race": "White",
+        "sex": "Male",
+        "native_country": "United-States",
+        "age": 34,
+        "education_num": 9,
+        "hours_per_week": 40}])
+    assert r.status_code == 503
+
+
+def test_post_cached(client):
+    user = {
+        "workclass": "Self-emp-inc",
+        "education": "Masters",
+        "marital_status": "Married-civ-spouse",
+        "occupation": "Exec-managerial",
+        "relationship": "Husband",
+        "race": "White",
+        "sex": "Male",
+        "native_country": "United-States",
+        "age": 51,
+        "education_num": 14,
+        "hours_per_week": 60}
+    api.cache.clear()
+    hits = client.get("/stats").json()["prediction_cache"]["hits"]
+    first = client.post("/", json=user)
+    second = client.post("/", json=user)
+    assert first.json() == second.json()
+    assert client.get("/stats").json()["prediction_cache"]["hits"] == hits + 1
+
+
+def test_get_metrics(client):
+    client.post("/", json={
+        "workclass": "Private",
+        "education": "Bachelors",
+        "marital_status": "Never-married",
+        "occupation": "Sales",
+        "relationship": "Own-child",
+        "race": "White",
+        "sex": "Female",
+        "native_country": "United-States",
+        "age": 23,
+        "education_num": 13,
+        "hours_per_week": 35})
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="POST",path="/",status="200"}' \
+        in r.text
+    assert 'inference_stage_duration_seconds_count{stage="validation"}' \
+        in r.text
+
+
+def test_post_stream(client, monkeypatch):
+    monkeypatch.setattr(api, "STREAM_CHUNK_SIZE", 2)
+    positive = {
+        "workclass": "State-gov",
+        "education": "Doctorate",
+        "marital_status": "Married-civ-spouse",
+        "occupation": "Prof-specialty",
+        "relationship": "Wife",
+        "race": "White",
+        "sex": "Female",
+        "native_country": "United-States",
+        "age": 48,
+        "education_num": 16,
+        "hours_per_week": 46}
+    negative = dict(positive, workclass="Private", education="HS-grad",
+                    marital_status="Divorced", occupation="Craft-repair",
+                    relationship="Not-in-family", sex="Male", age=34,
+                    education_num=9, hours_per_week=40)
+    lines = [json.dumps(positive), json.dumps(negative), "",
+             json.dumps(dict(positive, age="old")), "not json",
+             json.dumps(positive)]
+
+    # Sent in small pieces, cutting lines in two:
+    body = ("\n".join(lines) + "\n").encode()
+    r = client.post("/stream", data=(body[i:i + 50]
+                                     for i in range(0, len(body), 50)))
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+
+    results = [json.loads(line) for line in r.text.splitlines()]
+    assert results[:2] == [{"prediction": ">50K"}, {"prediction": "<=50K"}]
+    assert results[2]["error"][0]["loc"] == ["age"]
+    assert "error" in results[3]
+    assert results[4] == {"prediction": ">50K"}
+    assert len(results) == 5
+
+
+def test_post_stream_line_too_long(client, monkeypatch):
+    monkeypatch.setattr(api, "STREAM_MAX_LINE_BYTES", 10)
+    r = client.post("/stream", data=b"x" * 100)
+    assert r.status_code == 200
+    assert "longer than 10 bytes" in r.json()["error"]
+
+
+def test_health_live(client):
+    r = client.get("/health/live")
+    assert r.status_code == 200
+    assert r.json() == {"status": "alive"}
+
+
+def test_health_ready(client):
+    """Check that readiness flips once artifacts are loaded and warmed up
+    """
+    deadline = time.perf_counter() + 30
+    r = client.get("/health/ready")
+    while r.status_code == 503 and time.perf_counter() < deadline:
+        time.sleep(0.05)
+        r = client.get("/health/ready")
+
+    assert r.status_code == 200
+    assert r.json() == {"status": "ready",
+                        "version": api.registry.get().version}
+
+
+def test_reload_failing_warm_up_keeps_serving(client, monkeypatch,
+                                              tmp_path):
+    """Check that artifacts failing the warm-up are never swapped in
+    """
+    import joblib
+    import pandas as pd
+
+    from sklearn.preprocessing import OneHotEncoder
+
+    for name in ["model.joblib", "ohe.joblib", "lb.joblib"]:
+        shutil.copy(os.path.join("./model", name), tmp_path / name)
+    registry = api.ModelRegistry(
+        model_pth=str(tmp_path / "model.joblib"),
+        cat_encoder_pth=str(tmp_path / "ohe.joblib"),
+        label_binarizer_pth=str(tmp_path / "lb.joblib"))
+    registry.add_check(api._warm_up)
+    artifacts = registry.load()
+    monkeypatch.setattr(api, "registry", registry)
+
+    # An encoder knowing a single category per feature, which does not
+    # match the number of features the model was trained on:
+    ohe = OneHotEncoder(handle_unknown="ignore").fit(pd.DataFrame(
+        [[cats[0] for cats in artifacts.cat_encoder.categories_]],
+        columns=api.u.get_categorical_features()))
+    joblib.dump(ohe, tmp_path / "ohe.joblib")
+
+    assert not registry.reload_if_changed()
+    assert registry.get() is artifacts
+
+    r = client.get("/health/ready")
+    assert r.status_code == 200
+    assert r.json() == {"status": "ready", "version": artifacts.version}
+
+    r = client.post("/", json={
+        "workclass": "State-gov",
+        "education": "Doctorate",
+        "marital_status": "Married-civ-spouse",
+        "occupation": "Prof-specialty",
+        "relationship": "Wife",
+        "race": "White",
+        "sex": "Female",
+        "native_country": "United-States",
+        "age": 48,
+        "education_num": 16,
+        "hours_per_week": 46})
+    assert r.status_code == 200
+    assert r.json() == {"prediction": ">50K"}
+
+
+def test_warm_up_users():
+    """Check that warm-up records are valid and cover several categories
+    """
+    users = api._warm_up_users(16)
+    assert len(users) == 16
+    assert len({user.workclass for user in users}) > 1
+
+
+def test_post_artifacts_unavailable(client, monkeypatch, tmp_path):
+    """Check that requests are turned away while artifacts cannot load
+    """
+    monkeypatch.setattr(api, "registry", api.ModelRegistry(
+        model_pth=str(tmp_path / "model.joblib"),
+        cat_encoder_pth=str(tmp_path / "ohe.joblib"),
+        label_binarizer_pth=str(tmp_path / "lb.joblib")))
+    monkeypatch.setattr(api.app.state, "load_future", None, raising=False)
+
+    r = client.post("/stream", data=b"")
+    assert r.status_code == 503
+    assert r.json() == {"detail": "Model artifacts failed to load"}
+    assert r.headers["Retry-After"] == "1"
+
+    r = client.get("/health/ready")
+    assert r.status_code == 503
+    assert r.json() == {"status": "loading"}
+    assert client.get("/health/live").status_code == 200
+
+
+def test_post_artifacts_pull_failed(client, monkeypatch, tmp_path):
+    """Check that requests are turned away while dvc fails to pull
+    """
+    import src.artifacts
+
+    monkeypatch.setattr(api, "registry", api.ModelRegistry(
+        model_pth=str(tmp_path / "model.joblib"),
+        cat_encoder_pth=str(tmp_path / "ohe.joblib"),
+        label_binarizer_pth=str(tmp_path / "lb.joblib")))
+    monkeypatch.setattr(api.app.state, "load_future", None, raising=False)
+    monkeypatch.setenv("DYNO", "web.1")
+    monkeypatch.setattr(src.artifacts, "_pulled", False)
+    monkeypatch.setattr(src.artifacts.os, "system",
+                        lambda cmd: int(cmd == "dvc pull"))
+    monkeypatch.chdir(tmp_path)
+    os.mkdir(".dvc")
+
+    r = client.post("/stream", data=b"")
+    assert r.status_code == 503
+    assert r.json() == {"detail": "Model artifacts failed to load"}
+    assert r.headers["Retry-After"] == "1"
+
+
+# Seconds from launching a server process to its first prediction:
+COLD_START_BUDGET = float(os.environ.get("COLD_START_BUDGET", "10"))
+
+
+def test_import_skips_training_dependencies():
+    """Check that serving does not import the training only dependencies
+    """
+    code = ("import sys, src.api; "
+            "print([m for m in ['sklearn', 'scipy', 'joblib'] "
+            "if m in sys.modules])")
+    out = subprocess.run([sys.executable, "-c", code], check=True,
+                         capture_output=True, text=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_cold_start_budget(tmp_path):
+    """Check the time from boot to the first served prediction
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    log = open(tmp_path / "server.log", "w")
+    body = json.dumps({
+        "workclass": "State-gov",
+        "education": "Doctorate",
+        "marital_status": "Married-civ-spouse",
+        "occupation": "Prof-specialty",
+        "relationship": "Wife",
+        "race": "White",
+        "sex": "Female",
+        "native_country": "United-States",
+        "age": 48,
+        "education_num": 16,
+        "hours_per_week": 46}).encode()
+
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.api:app",
+         "--port", str(port), "--log-level", "warning"],
+        stdout=log, stderr=subprocess.STDOUT)
+    try:
+        while True:
+            elapsed = time.perf_counter() - start
+            assert elapsed < COLD_START_BUDGET, (
+                f"No prediction served {COLD_START_BUDGET} s after boot")
+            assert server.poll() is None, "Server exited during startup"
+            request = urllib.request.Request(
+                f"http://127.0.0.1:{port}/", data=body,
+                headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request, timeout=5) as r:
+                    assert json.load(r) == {"prediction": ">50K"}
+                    break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait()
+        log.close()
@@ -0,0 +1,69 @@
+"""Test artifacts module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import pytest
+
+import src.artifacts as a
+
+
+@pytest.fixture
+def commands(tmp_path, monkeypatch):
+    """Run in a fresh directory with the shell commands recorded
+    """
+    commands = []
+
+    def system(cmd):
+        commands.append(cmd)
+        if cmd.startswith("rm "):
+            os.rmdir(".dvc")
+        return 0
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(a.os, "system", system)
+    monkeypatch.setattr(a, "_pulled", False)
+    return commands
+
+
+def test_pull_outside_heroku(commands, monkeypatch):
+    """Check that nothing is pulled outside of a Heroku dyno
+    """
+    monkeypatch.delenv("DYNO", raising=False)
+    os.mkdir(".dvc")
+
+    assert not a.pull_artifacts()
+    assert commands == []
+
+
+def test_pull_once(commands, monkeypatch):
+    """Check that artifacts are pulled on the first call only
+    """
+    monkeypatch.setenv("DYNO", "web.1")
+    os.mkdir(".dvc")
+
+    assert a.pull_artifacts()
+    assert "dvc pull" in commands
+    assert not a.pull_artifacts()
+    assert commands.count("dvc pull") == 1
+
+
+def test_pull_failed(commands, monkeypatch):
+    """Check that a failed pull raises and is tried again by the next call
+    """
+    monkeypatch.setenv("DYNO", "web.1")
+
+    def system(cmd):
+        commands.append(cmd)
+        return int(cmd == "dvc pull")
+
+    monkeypatch.setattr(a.os, "system", system)
+    os.mkdir(".dvc")
+
+    with pytest.raises(RuntimeError):
+        a.pull_artifacts()
+    with pytest.raises(RuntimeError):
+        a.pull_artifacts()
+    assert commands.count("dvc pull") == 2
+    assert os.path.isdir(".dvc")
@@ -6,7 +6,10 @@ Date: 2022-01-07
 import pytest
 import pandas as pd
 
-from src.basic_cleaning import clean_data
+import src.schema as sc
+import src.basic_cleaning as bc
+
+from src.basic_cleaning import clean_csv, clean_data
 
 
 @pytest.fixture
@@ -36,3 +39,40 @@ def test_removed_columns(data):
     assert "fnlgt" not in data.columns
     assert "capital-gain" not in data.columns
     assert "capital-loss" not in data.columns
+
+
+def test_schema_read(data):
+    """Check that cleaning a file read with the schema gives the same data
+    """
+    df = clean_data(sc.read_csv("./data/raw_data/raw_census.csv"))
+
+    assert df["workclass"].dtype == "category"
+    pd.testing.assert_frame_equal(df.astype(object), data.astype(object))
+
+
+def test_clean_csv(data, tmp_path):
+    """Check that chunked cleaning writes the rows of the in memory cleaning
+    """
+    clean_pth = str(tmp_path / "clean.csv")
+    counts = clean_csv("./data/raw_data/raw_census.csv", clean_pth,
+                       chunksize=5000, n_jobs=2)
+    df = pd.read_csv(clean_pth, skipinitialspace=True)
+
+    pd.testing.assert_frame_equal(df, data.reset_index(drop=True))
+    assert counts["rows kept"] == len(data)
+    assert counts["rows read"] - counts["rows kept"] == \
+        counts["rows dropped: missing values"]
+    assert counts["rows dropped: missing workclass"] > 0
+
+
+def test_execute_chunked_removes_cache(tmp_path, monkeypatch):
+    """Check that chunked cleaning drops the cache of the previous CSV
+    """
+    cache_pth = tmp_path / "data" / "clean_data" / "clean_census_cache"
+    cache_pth.mkdir(parents=True)
+    (cache_pth / "meta.json").write_text("{}")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bc, "clean_csv", lambda *args, **kwargs: None)
+
+    bc.execute(chunksize=1000)
+    assert not cache_pth.exists()
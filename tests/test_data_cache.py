@@ -0,0 +1,66 @@
+"""Test data cache module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import pytest
+import pandas as pd
+
+import src.data_cache as dc
+
+
+@pytest.fixture
+def data():
+    """Obtain the clean dataset
+    """
+    df = pd.read_csv("./data/clean_data/clean_census.csv",
+                     skipinitialspace=True)
+    return df
+
+
+def test_round_trip(data, tmp_path):
+    """Check that the cached dataset has the values of the CSV
+    """
+    cache_pth = str(tmp_path / "cache")
+    dc.save_frame(data, cache_pth, "hash")
+    cached = dc.load_frame(cache_pth, "hash")
+
+    assert list(cached.columns) == list(data.columns)
+    assert cached["workclass"].dtype == "category"
+    assert cached["age"].dtype == data["age"].dtype
+    pd.testing.assert_frame_equal(cached.astype(object), data.astype(object))
+
+
+def test_stale_cache(data, tmp_path):
+    """Check that a cache saved from another source is not loaded
+    """
+    cache_pth = str(tmp_path / "cache")
+    assert dc.load_frame(cache_pth, "hash") is None
+
+    dc.save_frame(data.head(10), cache_pth, "hash")
+    assert dc.load_frame(cache_pth, "other hash") is None
+
+
+def test_read_clean_data_builds_cache(data, tmp_path):
+    """Check that a missing cache is built from the clean CSV and then used
+    """
+    clean_pth = str(tmp_path / "clean.csv")
+    data.head(10).to_csv(clean_pth, index=False)
+    cache_pth = str(tmp_path / "cache")
+
+    assert len(dc.read_clean_data(clean_pth, cache_pth)) == 10
+    cached = dc.load_frame(cache_pth, dc.file_hash(clean_pth))
+    assert cached is not None and len(cached) == 10
+
+
+def test_read_clean_data_clean_csv_changed(data, tmp_path):
+    """Check that editing the clean CSV invalidates its cache
+    """
+    clean_pth = str(tmp_path / "clean.csv")
+    data.to_csv(clean_pth, index=False)
+    cache_pth = str(tmp_path / "cache")
+    assert len(dc.read_clean_data(clean_pth, cache_pth)) == len(data)
+
+    data.head(100).to_csv(clean_pth, index=False)
+    assert dc.load_frame(cache_pth, dc.file_hash(clean_pth)) is None
+    assert len(dc.read_clean_data(clean_pth, cache_pth)) == 100
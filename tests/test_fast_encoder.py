@@ -0,0 +1,69 @@
+"""Test fast encoder module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import pytest
+import joblib
+import numpy as np
+import pandas as pd
+
+import src.utils as u
+
+from types import SimpleNamespace
+from src.fast_encoder import FastEncoder
+
+
+@pytest.fixture
+def data():
+    """Obtain a sample of the clean dataset
+    """
+    df = pd.read_csv("./data/clean_data/clean_census.csv",
+                     skipinitialspace=True)
+    return df.sample(n=500, random_state=0)
+
+
+@pytest.fixture
+def cat_encoder():
+    return joblib.load("./model/ohe.joblib")
+
+
+def test_encode_matches_process_data(data, cat_encoder):
+    """Check that the fast path produces exactly the process_data features
+    """
+    label_binarizer = joblib.load("./model/lb.joblib")
+    X_expected, _, _, _ = u.process_data(
+        df=data,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=cat_encoder,
+        label_binarizer=label_binarizer)
+
+    encoder = FastEncoder.from_encoder(
+        cat_encoder,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features())
+    records = [
+        SimpleNamespace(**{k.replace("-", "_"): v for k, v in row.items()})
+        for row in data.to_dict(orient="records")]
+    X = encoder.encode(records)
+
+    assert X.dtype == X_expected.dtype
+    np.testing.assert_array_equal(X, X_expected)
+
+
+def test_encode_unknown_category(data, cat_encoder):
+    """Check that unknown categories are rejected like OneHotEncoder does
+    """
+    encoder = FastEncoder.from_encoder(
+        cat_encoder,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features())
+    row = data.iloc[0].to_dict()
+    row["race"] = "Martian"
+    record = SimpleNamespace(**{k.replace("-", "_"): v
+                                for k, v in row.items()})
+
+    with pytest.raises(ValueError):
+        encoder.encode([record])
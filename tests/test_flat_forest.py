@@ -0,0 +1,93 @@
+"""Test flat forest module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import pytest
+import joblib
+import numpy as np
+import pandas as pd
+
+import src.utils as u
+
+from src.flat_forest import FlatForest
+
+
+@pytest.fixture
+def model():
+    return joblib.load("./model/model.joblib")
+
+
+@pytest.fixture
+def X():
+    """Obtain processed features of a sample of the clean dataset
+    """
+    df = pd.read_csv("./data/clean_data/clean_census.csv",
+                     skipinitialspace=True)
+    X, _, _, _ = u.process_data(
+        df=df.sample(n=2000, random_state=0),
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=joblib.load("./model/ohe.joblib"),
+        label_binarizer=joblib.load("./model/lb.joblib"))
+    return X
+
+
+def test_predict_matches_sklearn(model, X):
+    """Check that the flat forest predicts exactly like the sklearn model
+    """
+    forest = FlatForest.from_sklearn(model)
+
+    np.testing.assert_allclose(forest.predict_proba(X),
+                               model.predict_proba(X))
+    np.testing.assert_array_equal(forest.predict(X), model.predict(X))
+    np.testing.assert_array_equal(forest.predict(X[:1]), model.predict(X[:1]))
+
+
+def test_save_load(model, X, tmp_path):
+    """Check that a saved forest loads back memory mapped and unchanged
+    """
+    forest = FlatForest.from_sklearn(model)
+    forest.save(str(tmp_path))
+    loaded = FlatForest.load(str(tmp_path), mmap_mode="r")
+
+    assert isinstance(loaded.feature.base, np.memmap)
+    assert isinstance(loaded._children.base, np.memmap)
+    assert loaded.max_depth == forest.max_depth
+    np.testing.assert_array_equal(loaded.predict(X), forest.predict(X))
+
+
+def test_feature_count_mismatch(model, X, tmp_path):
+    """Check that batches of the wrong width are rejected, also once loaded
+    """
+    forest = FlatForest.from_sklearn(model)
+    forest.save(str(tmp_path))
+    loaded = FlatForest.load(str(tmp_path), mmap_mode="r")
+
+    assert loaded.n_features == model.n_features_in_
+    for f in [forest, loaded]:
+        with pytest.raises(ValueError):
+            f.predict(X[:, :-1])
+        with pytest.raises(ValueError):
+            f.predict_proba(np.hstack([X, X[:, :1]]))
+
+
+def test_save_keeps_mapped_arrays(model, X, tmp_path):
+    """Check that saving over a loaded forest leaves its mappings intact
+    """
+    forest = FlatForest.from_sklearn(model)
+    forest.save(str(tmp_path / "forest"))
+    loaded = FlatForest.load(str(tmp_path / "forest"), mmap_mode="r")
+    y_pred = loaded.predict(X)
+
+    # Same trees with swapped class probabilities, and fewer nodes:
+    other = FlatForest.from_sklearn(model)
+    other.value = other.value[::-1, ::-1].copy()
+    other.feature = other.feature[:10].copy()
+    other.save(str(tmp_path / "forest"))
+
+    np.testing.assert_array_equal(loaded.predict(X), y_pred)
+    reloaded = FlatForest.load(str(tmp_path / "forest"), mmap_mode="r")
+    assert len(reloaded.feature) == 10
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["forest"]
@@ -0,0 +1,142 @@
+"""Test lookup table module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import pytest
+import joblib
+import numpy as np
+import pandas as pd
+
+import src.utils as u
+
+from types import SimpleNamespace
+from src.lookup_table import LookupTable
+
+
+@pytest.fixture
+def df():
+    df = pd.read_csv("./data/clean_data/clean_census.csv",
+                     skipinitialspace=True)
+    return df.sample(n=2000, random_state=0)
+
+
+@pytest.fixture
+def artifacts():
+    return (joblib.load("./model/model.joblib"),
+            joblib.load("./model/ohe.joblib"),
+            joblib.load("./model/lb.joblib"))
+
+
+@pytest.fixture
+def table(df, artifacts):
+    model, cat_encoder, label_binarizer = artifacts
+    return LookupTable.build(
+        df=df,
+        model=model,
+        cat_encoder=cat_encoder,
+        label_binarizer=label_binarizer,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        source_hashes=["a", "b", "c"])
+
+
+def _record(row):
+    """Expose a dataframe row by attribute, like the API request models
+    """
+    return SimpleNamespace(**{k.replace("-", "_"): v
+                              for k, v in row.items()})
+
+
+def test_get_matches_model(df, artifacts, table):
+    """Check that every tabulated record gets the model prediction
+    """
+    model, cat_encoder, label_binarizer = artifacts
+    X, _, _, _ = u.process_data(
+        df=df,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=cat_encoder,
+        label_binarizer=label_binarizer)
+    expected = label_binarizer.inverse_transform(model.predict(X))
+
+    labels = [table.get(_record(row)) for row in df.to_dict("records")]
+
+    assert len(table) == len(df.drop_duplicates(
+        u.get_categorical_features() + u.get_numerical_features()))
+    np.testing.assert_array_equal(labels, expected)
+    assert table.stats()["hit_rate"] == 1.0
+
+
+def test_get_out_of_domain(df, table):
+    """Check that records outside the table are counted as misses
+    """
+    row = df.iloc[0].to_dict()
+    row["age"] = 200
+    assert table.get(_record(row)) is None
+
+    row = df.iloc[0].to_dict()
+    row["native-country"] = "Atlantis"
+    assert table.get(_record(row)) is None
+
+    assert table.stats()["misses"] == 2
+
+
+def test_max_entries(df, artifacts, table):
+    """Check that max_entries keeps the most frequent records only
+    """
+    model, cat_encoder, label_binarizer = artifacts
+    small = LookupTable.build(
+        df=df,
+        model=model,
+        cat_encoder=cat_encoder,
+        label_binarizer=label_binarizer,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        max_entries=10)
+
+    assert len(small) == 10
+    for row in df.to_dict("records"):
+        label = small.get(_record(row))
+        assert label is None or label == table.get(_record(row))
+    # The ten most frequent records cover more than ten rows:
+    assert small.stats()["hits"] > 10
+
+
+def test_save_load(df, table, tmp_path):
+    """Check that a saved table loads back unchanged unless it is stale
+    """
+    table.save(str(tmp_path / "lookup"))
+    loaded = LookupTable.load(str(tmp_path / "lookup"), ["a", "b", "c"])
+
+    np.testing.assert_array_equal(loaded.keys, table.keys)
+    np.testing.assert_array_equal(loaded.values, table.values)
+    record = _record(df.iloc[0].to_dict())
+    assert loaded.get(record) == table.get(record)
+
+    assert LookupTable.load(str(tmp_path / "lookup"), ["x", "b", "c"]) is None
+    assert LookupTable.load(str(tmp_path / "missing")) is None
+
+
+def test_save_keeps_mapped_table(df, artifacts, table, tmp_path):
+    """Check that saving over a loaded table leaves its mappings intact
+    """
+    table.save(str(tmp_path / "lookup"))
+    loaded = LookupTable.load(str(tmp_path / "lookup"))
+    keys = loaded.keys.copy()
+    values = loaded.values.copy()
+
+    model, cat_encoder, label_binarizer = artifacts
+    LookupTable.build(
+        df=df.iloc[:100],
+        model=model,
+        cat_encoder=cat_encoder,
+        label_binarizer=label_binarizer,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features()).save(
+            str(tmp_path / "lookup"))
+
+    np.testing.assert_array_equal(loaded.keys, keys)
+    np.testing.assert_array_equal(loaded.values, values)
+    assert len(LookupTable.load(str(tmp_path / "lookup"))) <= 100
@@ -0,0 +1,42 @@
+"""Test metrics module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+from src.metrics import MetricsRegistry
+
+
+def test_render_counter_and_gauge():
+    """Check the text exposition of labelled counters and gauges
+    """
+    metrics = MetricsRegistry()
+    requests = metrics.counter("requests_total", "Requests.", ["path"])
+    in_flight = metrics.gauge("in_flight", "In flight.")
+    requests.inc(path="/")
+    requests.inc(2, path="/")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+
+    text = metrics.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{path="/"} 3' in text
+    assert "in_flight 1" in text
+
+
+def test_render_histogram():
+    """Check that histogram buckets are cumulative with sum and count
+    """
+    metrics = MetricsRegistry()
+    latency = metrics.histogram("latency", "Latency.", ["stage"],
+                                buckets=(0.1, 1.0))
+    latency.observe(0.05, stage="predict")
+    latency.observe(0.5, stage="predict")
+    latency.observe(5.0, stage="predict")
+
+    lines = metrics.render().splitlines()
+    assert 'latency_bucket{stage="predict",le="0.1"} 1' in lines
+    assert 'latency_bucket{stage="predict",le="1.0"} 2' in lines
+    assert 'latency_bucket{stage="predict",le="+Inf"} 3' in lines
+    assert 'latency_sum{stage="predict"} 5.55' in lines
+    assert 'latency_count{stage="predict"} 3' in lines
@@ -0,0 +1,74 @@
+"""Test micro-batching module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import asyncio
+
+from src.micro_batching import MicroBatcher, QueueFullError
+
+
+def _run(coro):
+    """Run a coroutine on a private event loop
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_concurrent_requests_are_coalesced():
+    """Check that concurrent records share batches and keep their results
+    """
+    batches = []
+
+    def predict_fn(records):
+        batches.append(len(records))
+        return [r * 10 for r in records]
+
+    batcher = MicroBatcher(predict_fn, max_batch_size=4, max_wait_ms=50)
+
+    async def main():
+        results = await asyncio.gather(*[batcher.submit(i) for i in range(10)])
+        await batcher.stop()
+        return results
+
+    assert _run(main()) == [i * 10 for i in range(10)]
+    assert batches == [4, 4, 2]
+    assert batcher.stats()["batch_size_histogram"] == {
+        "1": 0, "2": 1, "4": 2, "+Inf": 0}
+
+
+def test_prediction_error_reaches_every_caller():
+    """Check that a failing batch raises for every record in it
+    """
+    def predict_fn(records):
+        raise ValueError("boom")
+
+    batcher = MicroBatcher(predict_fn, max_batch_size=4, max_wait_ms=10)
+
+    async def main():
+        results = await asyncio.gather(
+            *[batcher.submit(i) for i in range(3)], return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    assert all(isinstance(r, ValueError) for r in _run(main()))
+
+
+def test_full_queue_is_rejected():
+    """Check that submitting beyond the queue bound fails fast
+    """
+    batcher = MicroBatcher(lambda records: records, max_queue_size=1)
+
+    async def main():
+        # The worker task only starts draining once both submits have run:
+        results = await asyncio.gather(
+            batcher.submit(1), batcher.submit(2), return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    first, second = _run(main())
+    assert first == 1
+    assert isinstance(second, QueueFullError)
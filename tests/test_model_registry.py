@@ -0,0 +1,166 @@
+"""Test model registry module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import os
+import shutil
+import pytest
+import numpy as np
+
+from src.model_export import export_compact
+from src.model_precompute import precompute_table
+from src.model_registry import ModelRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    """Get registry over a private copy of the model artifacts
+    """
+    for name in ["model.joblib", "ohe.joblib", "lb.joblib"]:
+        shutil.copy(os.path.join("./model", name), tmp_path / name)
+
+    return ModelRegistry(
+        model_pth=str(tmp_path / "model.joblib"),
+        cat_encoder_pth=str(tmp_path / "ohe.joblib"),
+        label_binarizer_pth=str(tmp_path / "lb.joblib"))
+
+
+def test_get_loads_once(registry):
+    """Check that artifacts are loaded lazily and then shared
+    """
+    assert not registry.loaded
+    artifacts = registry.get()
+    assert registry.loaded
+    assert registry.get() is artifacts
+    assert artifacts.version == 1
+
+
+def test_reload_unchanged(registry):
+    """Check that unchanged files do not trigger a reload
+    """
+    artifacts = registry.load()
+    assert not registry.reload_if_changed()
+    assert registry.get() is artifacts
+
+
+def test_reload_changed(registry):
+    """Check that a changed file swaps in a new snapshot
+    """
+    artifacts = registry.load()
+    stat = os.stat(registry.paths[0])
+    os.utime(registry.paths[0], ns=(stat.st_atime_ns,
+                                    stat.st_mtime_ns + 10**9))
+
+    assert registry.reload_if_changed()
+    assert registry.get() is not artifacts
+    assert registry.get().version == 2
+
+
+def test_reload_broken_file_keeps_serving(registry):
+    """Check that a corrupt file keeps the previous snapshot in place
+    """
+    artifacts = registry.load()
+    with open(registry.paths[0], "wb") as f:
+        f.write(b"not a pickle")
+
+    assert not registry.reload_if_changed()
+    assert registry.get() is artifacts
+
+
+def test_listeners_run_on_load(registry):
+    """Check that listeners are told about every newly loaded snapshot
+    """
+    seen = []
+    registry.add_listener(lambda artifacts: seen.append(artifacts.version))
+    registry.load()
+    registry.load()
+
+    assert seen == [1, 2]
+
+
+def test_failing_check_keeps_serving(registry):
+    """Check that candidates rejected by a check are never swapped in
+    """
+    artifacts = registry.load()
+    seen = []
+    registry.add_listener(lambda artifacts: seen.append(artifacts.version))
+
+    def reject(artifacts):
+        raise ValueError("broken")
+
+    registry.add_check(reject)
+    with pytest.raises(ValueError):
+        registry.load()
+
+    assert registry.get() is artifacts
+    assert seen == []
+
+
+@pytest.fixture
+def compact_registry(registry, tmp_path):
+    """Get registry with a compact export of its artifacts
+    """
+    compact_pth = str(tmp_path / "compact")
+    export_compact(*registry.paths, compact_pth)
+
+    return ModelRegistry(*registry.paths, compact_pth=compact_pth)
+
+
+def test_prefers_compact_export(compact_registry):
+    """Check that an up to date compact export is loaded memory mapped
+    """
+    artifacts = compact_registry.get()
+
+    assert artifacts.model is None
+    assert isinstance(artifacts.forest.feature.base, np.memmap)
+    assert artifacts.forest.n_features == artifacts.encoder.n_features
+    assert list(artifacts.label_binarizer.classes_) == ["<=50K", ">50K"]
+
+
+def test_stale_compact_export(compact_registry):
+    """Check that a compact export of older artifacts is ignored
+    """
+    with open(compact_registry.paths[2], "ab") as f:
+        f.write(b"\0")
+
+    # The appended byte is ignored by the unpickler:
+    assert compact_registry.get().model is not None
+
+
+def test_compact_export_without_joblib(compact_registry):
+    """Check that a compact export is enough to serve
+    """
+    for pth in compact_registry.paths:
+        os.remove(pth)
+
+    assert compact_registry.get().model is None
+
+
+def test_lookup_table(registry, tmp_path):
+    """Check that a lookup table is only served while it matches the model
+    """
+    lookup_pth = str(tmp_path / "lookup")
+    precompute_table("./data/clean_data/clean_census.csv", *registry.paths,
+                     lookup_pth, max_entries=100)
+    registry = ModelRegistry(*registry.paths, lookup_pth=lookup_pth)
+    assert len(registry.get().lookup) == 100
+
+    with open(registry.paths[0], "ab") as f:
+        f.write(b"\0")
+
+    assert registry.reload_if_changed()
+    assert registry.get().lookup is None
+
+
+def test_reexport_keeps_serving_snapshot(compact_registry):
+    """Check that exporting over a served compact export is only picked up
+    by a reload
+    """
+    artifacts = compact_registry.get()
+    roots = artifacts.forest.roots.copy()
+    export_compact(*compact_registry.paths, compact_registry.compact_pth)
+
+    np.testing.assert_array_equal(artifacts.forest.roots, roots)
+    assert compact_registry.reload_if_changed()
+    assert compact_registry.get().model is None
@@ -0,0 +1,81 @@
+"""Test model scoring module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import joblib
+import numpy as np
+import pandas as pd
+
+import src.utils as u
+
+from src.model_scoring import score_csv
+
+
+def test_score_csv_in_chunks(tmp_path):
+    """Check that chunked scoring predicts every row in the input order
+    """
+    df = pd.read_csv("./data/clean_data/clean_census.csv",
+                     skipinitialspace=True).head(250)
+    input_pth = tmp_path / "input.csv"
+    output_pth = tmp_path / "predictions.csv"
+    df.to_csv(input_pth, index=False)
+
+    n_rows = score_csv(
+        input_pth=str(input_pth),
+        output_pth=str(output_pth),
+        model_pth="./model/model.joblib",
+        cat_encoder_pth="./model/ohe.joblib",
+        label_binarizer_pth="./model/lb.joblib",
+        chunksize=100)
+
+    label_binarizer = joblib.load("./model/lb.joblib")
+    X, _, _, _ = u.process_data(
+        df=df,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=joblib.load("./model/ohe.joblib"),
+        label_binarizer=label_binarizer)
+    expected = label_binarizer.inverse_transform(
+        u.inference(joblib.load("./model/model.joblib"), X))
+
+    predictions = pd.read_csv(output_pth)
+    assert n_rows == 250
+    assert list(predictions.columns) == ["prediction", "error"]
+    np.testing.assert_array_equal(predictions["prediction"].values, expected)
+    assert predictions["error"].isna().all()
+
+
+def test_score_csv_invalid_rows(tmp_path):
+    """Check that invalid rows are reported and the others still scored
+    """
+    df = pd.read_csv("./data/clean_data/clean_census.csv",
+                     skipinitialspace=True).head(250).astype(object)
+    df.loc[5, "workclass"] = "Astronaut"
+    df.loc[120, "occupation"] = "?"
+    df.loc[130, "age"] = "old"
+    df.loc[200:249, "native-country"] = "Atlantis"
+    input_pth = tmp_path / "input.csv"
+    output_pth = tmp_path / "predictions.csv"
+    df.to_csv(input_pth, index=False)
+
+    n_rows = score_csv(
+        input_pth=str(input_pth),
+        output_pth=str(output_pth),
+        model_pth="./model/model.joblib",
+        cat_encoder_pth="./model/ohe.joblib",
+        label_binarizer_pth="./model/lb.joblib",
+        chunksize=50)
+
+    predictions = pd.read_csv(output_pth, keep_default_na=False)
+    invalid = [5, 120, 130] + list(range(200, 250))
+    assert n_rows == 250 - len(invalid)
+    assert len(predictions) == 250
+    assert (predictions["prediction"][invalid] == "").all()
+    assert predictions["error"][5] == "missing or unknown workclass"
+    assert predictions["error"][120] == "missing or unknown occupation"
+    assert predictions["error"][130] == "missing or non-numeric age"
+    valid = predictions.drop(index=invalid)
+    assert valid["prediction"].isin(["<=50K", ">50K"]).all()
+    assert (valid["error"] == "").all()
@@ -0,0 +1,103 @@
+"""Test model training module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import pytest
+import numpy as np
+
+import src.utils as u
+import src.schema as sc
+import src.model_training as mt
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import LabelBinarizer, OneHotEncoder
+
+
+CLEAN_DATA_PATH = "./data/clean_data/clean_census.csv"
+
+
+@pytest.fixture
+def read_chunks():
+    """Stream the first 4000 rows of the clean dataset in chunks of 1000
+    """
+    return lambda: sc.read_csv(CLEAN_DATA_PATH, chunksize=1000, nrows=4000)
+
+
+def test_fit_encoders_matches_in_memory(read_chunks):
+    """Check that streamed encoders match encoders fitted on all rows
+    """
+    df = sc.read_csv(CLEAN_DATA_PATH, nrows=4000)
+    cat_features = u.get_categorical_features()
+    cat_encoder, label_binarizer, n_rows = mt.fit_encoders(
+        read_chunks(), cat_features)
+
+    expected = OneHotEncoder().fit(df[cat_features])
+    assert n_rows == 4000
+    for cats, expected_cats in zip(cat_encoder.categories_,
+                                   expected.categories_):
+        np.testing.assert_array_equal(cats, expected_cats)
+    np.testing.assert_array_equal(
+        label_binarizer.classes_,
+        LabelBinarizer().fit(df[sc.LABEL].values).classes_)
+
+
+def test_train_model_out_of_core(read_chunks, monkeypatch):
+    """Check that the forest grows to n_estimators across the chunks
+    """
+    monkeypatch.setattr(u, "_get_model_params", lambda: {
+        "n_estimators": 10, "random_state": 42, "max_depth": 3,
+        "n_jobs": 1})
+    model, cat_encoder, label_binarizer = mt.train_model_out_of_core(
+        read_chunks)
+
+    assert len(model.estimators_) == 10
+    df = sc.read_csv(CLEAN_DATA_PATH, nrows=4000)
+    X, y, _, _ = u.process_data(
+        df=df,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=cat_encoder,
+        label_binarizer=label_binarizer)
+    accuracy, _, _ = u.calculate_metrics(y, model.predict(X))
+    assert accuracy > 0.75
+
+
+def test_train_model_out_of_core_missing_class(monkeypatch):
+    """Check that trees of a chunk missing a class move to the next chunk
+    """
+    df = sc.read_csv(CLEAN_DATA_PATH, nrows=4000)
+    df = df.sort_values(sc.LABEL, kind="stable")
+    n_low = int((df[sc.LABEL] == "<=50K").sum())
+    # One chunk of a single class, then one holding both classes:
+    chunks = [df.iloc[:n_low - 500], df.iloc[n_low - 500:]]
+    monkeypatch.setattr(u, "_get_model_params", lambda: {
+        "n_estimators": 10, "random_state": 42, "max_depth": 3,
+        "n_jobs": 1})
+    model, _, _ = mt.train_model_out_of_core(lambda: iter(chunks))
+
+    assert len(model.estimators_) == 10
+
+
+def test_train_model_out_of_core_uses_every_row(monkeypatch):
+    """Check that no row is dropped when there are more chunks than trees
+    """
+    fitted_rows = []
+
+    class RecordingForest(RandomForestClassifier):
+        def fit(self, X, y, sample_weight=None):
+            fitted_rows.append(X.shape[0])
+            return super().fit(X, y, sample_weight)
+
+    monkeypatch.setattr(mt, "RandomForestClassifier", RecordingForest)
+    monkeypatch.setattr(u, "_get_model_params", lambda: {
+        "n_estimators": 10, "random_state": 42, "max_depth": 3,
+        "n_jobs": 1})
+    model, _, _ = mt.train_model_out_of_core(
+        lambda: sc.read_csv(CLEAN_DATA_PATH, chunksize=100, nrows=4000))
+
+    # 40 chunks of 100 rows, 80 of which are kept for training:
+    assert len(model.estimators_) == 10
+    assert len(fitted_rows) == 10
+    assert sum(fitted_rows) == 40 * 80
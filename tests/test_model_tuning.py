@@ -0,0 +1,49 @@
+"""Test model tuning module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import pytest
+import pandas as pd
+
+import src.utils as u
+
+from src.model_tuning import save_params, tune_model
+
+
+@pytest.fixture
+def data():
+    """Obtain a sample of the clean dataset
+    """
+    df = pd.read_csv("./data/clean_data/clean_census.csv",
+                     skipinitialspace=True)
+    return df.sample(n=1500, random_state=0)
+
+
+def test_tune_model(data):
+    """Check that the search returns parameters from the search space
+    """
+    param_distributions = {
+        "n_estimators": [5, 10],
+        "max_depth": [2, 4, 6],
+    }
+    params, score = tune_model(data, n_candidates=6, n_jobs=1,
+                               param_distributions=param_distributions)
+
+    assert set(params) == set(param_distributions)
+    assert params["n_estimators"] in param_distributions["n_estimators"]
+    assert params["max_depth"] in param_distributions["max_depth"]
+    assert 0.5 < score <= 1.0
+
+
+def test_saved_params_override_defaults(tmp_path):
+    """Check that tuned parameters are picked up by _get_model_params
+    """
+    params_pth = str(tmp_path / "model_params.json")
+    save_params({"max_depth": 8, "min_samples_leaf": 5}, 0.9, "roc_auc",
+                params_pth)
+
+    params = u._get_model_params(params_pth)
+    assert params["max_depth"] == 8
+    assert params["min_samples_leaf"] == 5
+    assert params["n_estimators"] == 200
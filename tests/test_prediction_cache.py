@@ -0,0 +1,53 @@
+"""Test prediction cache module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import time
+
+from pydantic import BaseModel
+from src.prediction_cache import PredictionCache
+
+
+class Record(BaseModel):
+    sex: str
+    age: int
+
+
+def test_make_key_is_canonical():
+    """Check that equal records share a key unless the model version differs
+    """
+    key = PredictionCache.make_key(Record(sex="Male", age=34), version=1)
+
+    assert key == PredictionCache.make_key(Record(age=34, sex="Male"), 1)
+    assert key != PredictionCache.make_key(Record(sex="Male", age=34), 2)
+    assert key != PredictionCache.make_key(Record(sex="Male", age=35), 1)
+
+
+def test_lru_eviction():
+    """Check that the least recently used entry is evicted first
+    """
+    cache = PredictionCache(max_size=2, ttl=0)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_expiration():
+    """Check that expired entries are not served
+    """
+    cache = PredictionCache(max_size=2, ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["size"] == 0
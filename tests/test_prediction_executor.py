@@ -0,0 +1,58 @@
+"""Test prediction executor module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import asyncio
+import threading
+
+from src.prediction_executor import BoundedExecutor, QueueFullError
+
+
+def _run(coro):
+    """Run a coroutine on a private event loop
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_run_off_event_loop():
+    """Check that jobs run on a pool thread and return their result
+    """
+    executor = BoundedExecutor(max_workers=2, max_queue_size=0)
+
+    async def main():
+        return await executor.run(lambda x: (x, threading.get_ident()), 7)
+
+    result, thread_id = _run(main())
+    executor.shutdown()
+
+    assert result == 7
+    assert thread_id != threading.get_ident()
+    assert executor.pending == 0
+
+
+def test_full_queue_is_rejected():
+    """Check that jobs beyond pool size plus queue size are turned away
+    """
+    executor = BoundedExecutor(max_workers=1, max_queue_size=1)
+    release = threading.Event()
+
+    async def main():
+        return await asyncio.gather(
+            executor.run(release.wait),
+            executor.run(release.wait),
+            executor.run(release.wait),
+            return_exceptions=True)
+
+    # Unblock the pool once every job has been submitted:
+    threading.Timer(0.2, release.set).start()
+    results = _run(main())
+    executor.shutdown()
+
+    assert results[:2] == [True, True]
+    assert isinstance(results[2], QueueFullError)
+    assert executor.stats()["rejected"] == 1
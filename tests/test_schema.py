@@ -0,0 +1,33 @@
+"""Test schema module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import joblib
+
+import src.schema as sc
+import src.utils as u
+
+
+def test_categories_match_encoder():
+    """Check that the User values are the categories the model was fit on
+    """
+    ohe = joblib.load("./model/ohe.joblib")
+    categories = sc.get_categories()
+
+    assert list(categories) == u.get_categorical_features()
+    for feat, fitted in zip(categories, ohe.categories_):
+        assert sorted(categories[feat]) == sorted(fitted)
+
+
+def test_read_csv():
+    """Check that files are parsed with the schema dtypes
+    """
+    df = sc.read_csv("./data/raw_data/raw_census.csv")
+
+    for feat in u.get_categorical_features():
+        assert df[feat].dtype == "category"
+        assert "?" not in df[feat].cat.categories
+    for feat in u.get_numerical_features():
+        assert df[feat].dtype == "int64"
+    assert df["workclass"].isna().any()
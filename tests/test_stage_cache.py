@@ -0,0 +1,66 @@
+"""Test stage cache module
+
+Author: Dan Sun
+Date: 2022-01-07
+"""
+import pytest
+
+from src.stage_cache import StageCache
+
+
+@pytest.fixture
+def stage(tmp_path):
+    """Obtain a stage copying its input to its output, and its run count
+    """
+    input_pth = tmp_path / "input.txt"
+    code_pth = tmp_path / "code.py"
+    output_pth = tmp_path / "output.txt"
+    input_pth.write_text("a")
+    code_pth.write_text("print('a')")
+    runs = []
+
+    def fn():
+        output_pth.write_text(input_pth.read_text())
+        runs.append(1)
+
+    def run(cache, params=None, force=False):
+        return cache.run("copy", fn, inputs=[str(input_pth)],
+                         outputs=[str(output_pth)], code=[str(code_pth)],
+                         params=params, force=force)
+
+    return run, runs, input_pth, code_pth, output_pth
+
+
+def test_skip_unchanged(stage, tmp_path):
+    """Check that a stage runs again only if a dependency changed
+    """
+    run, runs, input_pth, code_pth, _ = stage
+    cache_pth = str(tmp_path / "stages.json")
+
+    assert run(StageCache(cache_pth))
+    assert not run(StageCache(cache_pth))
+    assert len(runs) == 1
+
+    input_pth.write_text("b")
+    assert run(StageCache(cache_pth))
+    code_pth.write_text("print('b')")
+    assert run(StageCache(cache_pth))
+    assert run(StageCache(cache_pth), params={"max_depth": 8})
+    assert not run(StageCache(cache_pth), params={"max_depth": 8})
+    assert run(StageCache(cache_pth), params={"max_depth": 8}, force=True)
+    assert len(runs) == 5
+
+
+def test_rerun_modified_output(stage, tmp_path):
+    """Check that a stage runs again if its output was changed or removed
+    """
+    run, runs, _, _, output_pth = stage
+    cache = StageCache(str(tmp_path / "stages.json"))
+
+    run(cache)
+    output_pth.write_text("modified")
+    assert run(cache)
+    output_pth.unlink()
+    assert run(cache)
+    assert output_pth.read_text() == "a"
+    assert len(runs) == 3
@@ -3,10 +3,12 @@
 Author: Dan Sun
 Date: 2022-01-07
 """
+import logging
 import pytest
 import joblib
 import numpy as np
 import pandas as pd
+import scipy.sparse
 
 import src.utils as u
 
@@ -136,3 +138,100 @@ def test_inference_neg():
     y_pred_label = label_binarizer.inverse_transform(y_pred)[0]
 
     assert y_pred_label == "<=50K"
+
+
+def test_process_data_sparse(data):
+    """Check that sparse mode holds the same features as dense mode
+    """
+    cat_encoder = joblib.load("./model/ohe.joblib")
+    label_binarizer = joblib.load("./model/lb.joblib")
+
+    kwargs = dict(
+        df=data,
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=cat_encoder,
+        label_binarizer=label_binarizer)
+    X_dense, y_dense, _, _ = u.process_data(**kwargs)
+    X_sparse, y_sparse, _, _ = u.process_data(
+        sparse=True, dtype=np.float32, **kwargs)
+
+    assert scipy.sparse.isspmatrix_csr(X_sparse)
+    assert X_sparse.dtype == np.float32
+    np.testing.assert_array_equal(X_sparse.toarray(), X_dense)
+    np.testing.assert_array_equal(y_sparse, y_dense)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_process_data_dtype_range(data, sparse):
+    """Check that numerical features are never wrapped by the dtype cast
+    """
+    df = data.head(3).copy()
+    kwargs = dict(
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        training=False,
+        cat_encoder=joblib.load("./model/ohe.joblib"),
+        label_binarizer=joblib.load("./model/lb.joblib"),
+        sparse=sparse)
+
+    df["age"] = [20, 90, 255]
+    X, _, _, _ = u.process_data(df=df, dtype=np.uint8, **kwargs)
+    assert X.dtype == np.uint8
+
+    df["age"] = [20, 90, 300]
+    with pytest.raises(ValueError):
+        u.process_data(df=df, dtype=np.uint8, **kwargs)
+
+    df["age"] = [20, 90, 30]
+    df["hours-per-week"] = [40, -1, 40]
+    with pytest.raises(ValueError):
+        u.process_data(df=df, dtype=np.uint8, **kwargs)
+    X, _, _, _ = u.process_data(df=df, dtype=np.float32, **kwargs)
+    assert X.min() == -1
+
+
+def test_calculate_slice_metrics(data):
+    """Check that grouped slice metrics match metrics computed per slice
+    """
+    df = data.sample(n=2000, random_state=0)
+    rng = np.random.RandomState(0)
+    y_true = rng.randint(0, 2, size=len(df))
+    y_pred = rng.randint(0, 2, size=len(df))
+
+    slice_metrics = u.calculate_slice_metrics(
+        df, y_true, y_pred, ["race", "native-country"])
+
+    expected_categories = list(df["race"].unique()) + \
+        list(df["native-country"].unique())
+    assert list(slice_metrics["category"]) == expected_categories
+    for row in slice_metrics.itertuples():
+        mask = (df[row.feature] == row.category).values
+        acc, recall, precision = u.calculate_metrics(
+            y_true[mask], y_pred[mask])
+        assert row.n == mask.sum()
+        assert np.isclose(row.accuracy, acc)
+        assert np.isclose(row.recall, recall)
+        assert np.isclose(row.precision, precision)
+
+
+def test_train_model_cv_scores(data, monkeypatch, caplog):
+    """Check that every cv score and fold time is reported from one cv run
+    """
+    params = u._get_model_params()
+    params["n_estimators"] = 5
+    monkeypatch.setattr(u, "_get_model_params", lambda: dict(params))
+
+    X, y, _, _ = u.process_data(
+        df=data.sample(n=1000, random_state=0),
+        cat_features=u.get_categorical_features(),
+        num_features=u.get_numerical_features(),
+        sparse=True)
+    with caplog.at_level(logging.INFO):
+        model = u.train_model(X, y, ["accuracy", "roc_auc", "f1"], n_jobs=2)
+
+    assert model.n_jobs == 2
+    assert len(model.estimators_) == 5
+    for s in ["accuracy", "roc_auc", "f1", "fit time per fold"]:
+        assert any(r.getMessage().startswith(s) for r in caplog.records)